@@ -0,0 +1,238 @@
+"""
+adaptive refinement module for heatmap
+
+Most of an influence grid is made of wide areas of one constant value,
+the detail sitting along the borders between values and the edges of the
+search radius. Adaptive filling splits the grid into blocks of a coarse
+lattice and evaluates each block at its corners, the middle of its sides
+and its middle. Blocks on which these agree on the value (within a
+tolerance) are filled in from their corners directly, the others are
+split in four down to blocks small enough to be evaluated cell by cell.
+Blocks holding a point, or reached by a value that doesn't cover all of
+them, are always split. Blocks out of reach of every point are left at 0
+without being evaluated at all.
+
+The result is an approximation: a value or a fade showing only between the
+evaluated cells of a block would be missed. It is meant for previews
+and big maps of large uniform areas.
+"""
+from typing import Callable, Iterable, List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from engines import GridFile, GridPoints, compute_window, sample_cells, window_points
+from spatial import SpatialIndex
+from sparse import SparseGrid
+
+# side of the blocks of the coarse lattice, in cells
+LATTICE_CELLS = 32
+# blocks no bigger than this are evaluated cell by cell
+MIN_BLOCK_CELLS = 4
+# height of the strips the small blocks are computed in
+STRIP_CELLS = 8
+
+
+def _values_agree(values: np.ndarray, mode: str, tolerance: float) -> bool:
+    """
+    Returns whether the values evaluated in a block, one row per cell,
+    are close enough for the block to be filled in from its corners
+    In influence mode they also have to have the same dominant value
+    """
+    low, high = values.min(axis=0), values.max(axis=0)
+    if mode == "influence" and (np.ceil(low) != np.ceil(high)).any():
+        return False
+    return bool((high - low <= tolerance).all())
+
+
+def _fill_block(corners: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Returns a block of every grid filled in from the values at its top left,
+    top right, bottom left and bottom right corners
+    """
+    if (corners == corners[0]).all():
+        return np.broadcast_to(corners[0][:, np.newaxis, np.newaxis],
+                               (len(corners[0]), height, width))
+    # bilinear interpolation between the corners
+    down = (np.arange(height) / max(height - 1, 1))[:, np.newaxis]
+    across = (np.arange(width) / max(width - 1, 1))[np.newaxis]
+    top_left, top_right, bottom_left, bottom_right = (corner[:, np.newaxis, np.newaxis]
+                                                      for corner in corners)
+    return ((1 - down) * ((1 - across) * top_left + across * top_right) +
+            down * ((1 - across) * bottom_left + across * bottom_right))
+
+
+def _lattice_spans(size: int) -> List[Tuple[int, int]]:
+    """
+    Returns the first and last cell of each coarse block along a side
+    of size cells, neighbouring blocks sharing their last and first cell
+    """
+    lines = sorted(set(range(0, size - 1, LATTICE_CELLS)) | {size - 1})
+    return list(zip(lines[:-1], lines[1:])) if len(lines) > 1 else [(0, 0)]
+
+
+def adaptive_window(engine: str, points: GridPoints, radius: float,
+                    rows: Tuple[int, int], cols: Tuple[int, int],
+                    index: Union[SpatialIndex, None] = None,
+                    tolerance: float = 0.0) -> Tuple[np.ndarray, int]:
+    """
+    Computes the cells in rows[0]:rows[1], cols[0]:cols[1] of every grid
+    with adaptive refinement, the blocks evaluated cell by cell being
+    computed with engine
+    Returns the window and the amount of cells that were evaluated
+
+    radius - search radius in grid cells
+    tolerance - biggest difference between the values evaluated in a block
+                filled in from its corners, with 0 only blocks of one value
+                are
+    """
+    points = points.subset(window_points(points.xs, points.ys, radius,
+                                         rows, cols, index))
+    # coordinates within the window, blocks being given as their first
+    # and last row and column within the window
+    xs, ys = points.xs - cols[0], points.ys - rows[0]
+    window = np.full((points.grids, rows[1] - rows[0], cols[1] - cols[0]), 0.0)
+    evaluated = np.zeros(window.shape[1:], dtype=bool)
+    samples = {}
+    blocks = [(top, bottom, left, right)
+              for top, bottom in _lattice_spans(window.shape[1])
+              for left, right in _lattice_spans(window.shape[2])]
+    exact = []
+
+    while blocks:
+        # every block of this level against every point at once
+        top, bottom, left, right = (np.array(side)[:, np.newaxis] for side in zip(*blocks))
+        nearest = np.hypot(np.maximum(np.maximum(left - xs, xs - right), 0),
+                           np.maximum(np.maximum(top - ys, ys - bottom), 0))
+        furthest = np.hypot(np.maximum(xs - left, right - xs),
+                            np.maximum(ys - top, bottom - ys))
+        reached = nearest <= radius
+        covering = furthest <= radius
+        # the weights peak at the points, so a block holding one can hide
+        # a value its corners don't show, and so can a block in which a
+        # value is only in range of part of the cells
+        holding = ((xs >= left) & (xs <= right) & (ys >= top) & (ys <= bottom)).any(axis=1)
+        # weighted values can be negative, only whether there is one counts
+        payload = (points.payload != 0).astype(float)
+        uneven = holding | ((((reached & ~covering) @ payload) > 0) &
+                            ((covering @ payload) == 0)).any(axis=1)
+        small = np.maximum(bottom - top, right - left)[:, 0] <= MIN_BLOCK_CELLS
+
+        candidates = []
+        for block, block_reached, block_small, block_uneven in zip(
+                blocks, reached.any(axis=1), small, uneven):
+            if not block_reached:
+                # out of reach of every point, left at 0
+                continue
+            if block_small:
+                exact.append(block)
+            else:
+                candidates.append((block, bool(block_uneven)))
+
+        # blocks are checked at their corners, the middle of their sides and
+        # their middle, which are the corners of the blocks they split into,
+        # sampled a strip of blocks sharing their rows at a time
+        strips = {}
+        for (top, bottom, left, right), uneven in candidates:
+            if not uneven:
+                lines = ((top, (top + bottom) // 2, bottom),
+                         (left, (left + right) // 2, right))
+                strips.setdefault(lines[0], set()).update(
+                    col for col in lines[1]
+                    if any((row, col) not in samples for row in lines[0]))
+        for strip_rows, strip_cols in strips.items():
+            if not strip_cols:
+                continue
+            strip_cols = sorted(strip_cols)
+            values = sample_cells(points, radius, np.array(strip_rows) + rows[0],
+                                  np.array(strip_cols) + cols[0])
+            for i, row in enumerate(strip_rows):
+                for j, col in enumerate(strip_cols):
+                    samples[(row, col)] = values[:, i, j]
+                    evaluated[row, col] = True
+
+        blocks = []
+        for (top, bottom, left, right), uneven in candidates:
+            middle_row, middle_col = (top + bottom) // 2, (left + right) // 2
+            if not uneven:
+                checked = np.array([samples[(row, col)]
+                                    for row in (top, middle_row, bottom)
+                                    for col in (left, middle_col, right)])
+                if _values_agree(checked, points.mode, tolerance):
+                    window[:, top:bottom + 1, left:right + 1] = _fill_block(
+                        checked[[0, 2, 6, 8]], bottom - top + 1, right - left + 1)
+                    continue
+            blocks.extend([(top, middle_row, left, middle_col),
+                           (top, middle_row, middle_col, right),
+                           (middle_row, bottom, left, middle_col),
+                           (middle_row, bottom, middle_col, right)])
+
+    # the small blocks are evaluated last, overwriting the cells they share
+    # with blocks filled in from corners. They are gathered into strips of
+    # rows, close blocks of a strip being computed in one go along with the
+    # few cells between them, which are evaluated exactly as well
+    marked = np.zeros(window.shape[1:], dtype=bool)
+    for top, bottom, left, right in exact:
+        marked[top:bottom + 1, left:right + 1] = True
+    for top in range(0, window.shape[1], STRIP_CELLS):
+        bottom = min(top + STRIP_CELLS, window.shape[1])
+        marked_cols = np.flatnonzero(marked[top:bottom].any(axis=0))
+        if not len(marked_cols):
+            continue
+        breaks = np.flatnonzero(np.diff(marked_cols) > STRIP_CELLS) + 1
+        for run in np.split(marked_cols, breaks):
+            left, right = int(run[0]), int(run[-1]) + 1
+            window[:, top:bottom, left:right] = compute_window(
+                engine, points, radius, (top + rows[0], bottom + rows[0]),
+                (left + cols[0], right + cols[0]))
+            evaluated[top:bottom, left:right] = True
+    return window, int(evaluated.sum())
+
+
+def _fill_adaptive_band(task: tuple) -> Tuple[np.ndarray, int]:
+    """
+    Worker side of fill_adaptive: computes a band
+    """
+    engine, points, radius, rows, cols, tolerance = task
+    return adaptive_window(engine, points, radius, rows, cols, None, tolerance)
+
+
+def fill_adaptive(grid: Union[np.ndarray, GridFile, SparseGrid], engine: str,
+                  points: GridPoints, radius: float, tolerance: float = 0.0,
+                  progress: Callable[[Iterable], Iterable] = lambda l: l,
+                  index: Union[SpatialIndex, None] = None, workers: int = 1) -> int:
+    """
+    Fills the stack of grids like fill_grid, with adaptive refinement,
+    a band of lattice blocks at a time
+    Returns the amount of cells that were evaluated
+    """
+    grid_height, grid_width = grid.shape[1:]
+    bands = [(row, min(row + LATTICE_CELLS, grid_height))
+             for row in range(0, grid_height, LATTICE_CELLS)]
+
+    def store(rows, band):
+        if isinstance(grid, GridFile):
+            grid.write_rows(rows[0], band)
+        elif isinstance(grid, SparseGrid):
+            grid.set_window(rows, (0, grid_width), band)
+        else:
+            grid[:, rows[0]:rows[1]] = band
+
+    evaluated = 0
+    if workers <= 1 or len(bands) <= 1:
+        for rows in progress(bands):
+            band, band_evaluated = adaptive_window(engine, points, radius, rows,
+                                                   (0, grid_width), index, tolerance)
+            store(rows, band)
+            evaluated += band_evaluated
+        return evaluated
+
+    def tasks():
+        for rows in bands:
+            near = window_points(points.xs, points.ys, radius, rows, (0, grid_width), index)
+            yield (engine, points.subset(near), radius, rows, (0, grid_width), tolerance)
+
+    with ProcessPoolExecutor(workers) as pool:
+        for rows, (band, band_evaluated) in zip(bands, progress(pool.map(_fill_adaptive_band,
+                                                                         tasks()))):
+            store(rows, band)
+            evaluated += band_evaluated
+    return evaluated
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+benchmark module for heatmap
+
+Times loading, preparing, grid generation and rendering on synthetic
+datasets in the csv layout the program reads (name, lat, lon, value), over
+a matrix of dataset sizes, modes, engines, scales and radii. Results are
+written to a json file and compared against a baseline run, the cases that
+got slower than the baseline by more than a threshold being reported as
+regressions.
+"""
+from typing import Dict, List, Tuple, Union
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+from utilities import load_columns
+from heatmap import Heatmap, MODES, ENGINES
+
+# lat_min, lon_min, lat_max and lon_max of the synthetic datasets
+DEFAULT_EXTENT = (45.4, 13.4, 46.9, 16.6)
+DEFAULT_POINTS = [250, 1000]
+DEFAULT_SCALES = [0.01, 0.005]
+DEFAULT_RADII = [0.1, 0.2]
+# cases slower than the baseline by more than this fraction are regressions
+DEFAULT_THRESHOLD = 0.25
+# the loop engine is only timed up to this many points
+MAX_LOOP_POINTS = 250
+
+
+def generate_dataset(filepath: str, points: int, mode: str = MODES[0],
+                     categories: int = 5, clusters: int = 0, spread: float = 0.05,
+                     extent: Tuple[float, float, float, float] = DEFAULT_EXTENT,
+                     seed: int = 0) -> str:
+    """
+    Writes a synthetic dataset to a csv file and returns its path
+
+    points - amount of rows
+    mode - influence datasets get category values, weighted ones numbers
+    categories - amount of distinct categories of influence datasets
+    clusters - amount of clusters the points are gathered around, spread
+               evenly over the extent if 0
+    spread - standard deviation of the clusters, relative to the extent
+    extent - lat_min, lon_min, lat_max and lon_max the points fall within
+    seed - seed of the random generator, the same seed giving the same dataset
+    """
+    assert mode in MODES, "invalid mode"
+    assert points >= 1 and categories >= 1 and clusters >= 0, "invalid dataset"
+    rng = np.random.default_rng(seed)
+    lat_min, lon_min, lat_max, lon_max = extent
+    low, high = np.array([lat_min, lon_min]), np.array([lat_max, lon_max])
+
+    if clusters:
+        centres = rng.uniform(low, high, (clusters, 2))
+        cluster = rng.integers(clusters, size=points)
+        coords = np.clip(centres[cluster] + rng.normal(0, spread, (points, 2)) * (high - low),
+                         low, high)
+        # neighbouring points tend to share a category, like real surveys do
+        labels = (cluster + rng.integers(2, size=points)) % categories
+    else:
+        coords = rng.uniform(low, high, (points, 2))
+        labels = rng.integers(categories, size=points)
+
+    if mode == MODES[0]:
+        values = ["value {}".format(label) for label in labels]
+    else:
+        values = ["{:.6f}".format(value) for value in rng.uniform(-1, 1, points)]
+
+    with open(filepath, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Name", "Latitude", "Longitude", "Value"])
+        for i, ((lat, lon), value) in enumerate(zip(coords, values)):
+            writer.writerow(["Point {}".format(i), "{:.7f}".format(lat),
+                             "{:.7f}".format(lon), value])
+    return filepath
+
+
+def best_time(function, repeat: int = 3) -> float:
+    """
+    Returns the shortest time out of repeat calls of function, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(points: List[int] = DEFAULT_POINTS, modes: List[str] = MODES,
+                   engines: List[str] = ENGINES, scales: List[float] = DEFAULT_SCALES,
+                   radii: List[float] = DEFAULT_RADII, categories: int = 5,
+                   clusters: int = 0, repeat: int = 3, render: bool = True,
+                   verbose: bool = False) -> Dict[str, float]:
+    """
+    Times every case of the benchmark matrix and returns the times in
+    seconds, by case name
+    Rendering is skipped if basemap isn't installed
+    """
+    verboseprint = print if verbose else lambda *a, **k: None
+    results = {}
+
+    def record(name, function):
+        results[name] = best_time(function, repeat)
+        verboseprint("{:<64} {:.4f}s".format(name, results[name]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in modes:
+            for size in points:
+                filepath = generate_dataset(
+                    os.path.join(directory, "{}_{}.csv".format(mode, size)), size, mode,
+                    categories, clusters)
+                dataset = "{}/points={}".format(mode, size)
+                record("load_columns/" + dataset, lambda: load_columns(filepath, mode=mode))
+                record("initialize_data/" + dataset,
+                       lambda: Heatmap(filepath, mode)._initialize_data())
+
+                for scale in scales:
+                    for radius in radii:
+                        case = "{}/scale={}/radius={}".format(dataset, scale, radius)
+                        for engine in engines:
+                            if engine == "loop" and size > MAX_LOOP_POINTS:
+                                continue
+                            heatmap = Heatmap(filepath, mode, scale=scale, radius=radius,
+                                              engine=engine)
+                            heatmap._initialize_data()
+
+                            def calculate():
+                                # forgetting the grid so that it is computed again
+                                heatmap._grid_state = None
+                                heatmap.calculate_grid()
+                            record("calculate_grid/{}/{}".format(engine, case), calculate)
+
+                        if render:
+                            try:
+                                record("save_map/" + case,
+                                       lambda: heatmap.save_map(io.BytesIO()))
+                            except ImportError as err:
+                                print("Skipping rendering: {}".format(err))
+                                render = False
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[str, float, float]]:
+    """
+    Returns the cases slower than in the baseline by more than threshold,
+    as their name, baseline time and time
+    Cases missing from either run are left out
+    """
+    return [(name, baseline[name], seconds) for name, seconds in sorted(results.items())
+            if name in baseline and seconds > baseline[name] * (1 + threshold)]
+
+
+def write_results(filepath: str, results: Dict[str, float], settings: dict) -> None:
+    """
+    Writes the results of a run to a json file, along with the settings of
+    the run and the environment it ran in
+    """
+    with open(filepath, "w") as file:
+        json.dump({"settings": settings,
+                   "environment": {"python": platform.python_version(),
+                                   "numpy": np.__version__,
+                                   "machine": platform.machine(),
+                                   "cpus": os.cpu_count()},
+                   "results": results}, file, indent=2, sort_keys=True)
+
+
+def read_results(filepath: str) -> Dict[str, float]:
+    """
+    Reads the results of a run written by write_results
+    """
+    with open(filepath) as file:
+        return json.load(file)["results"]
+
+
+def parse_list(text: Union[str, None], kind: type) -> Union[list, None]:
+    """
+    Parses a comma separated list of values
+    """
+    return None if text == None else [kind(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Times heatmap generation on "
+                                                  "synthetic datasets"))
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="json file the results are written to")
+    parser.add_argument("-b", "--baseline",
+                        help="json file of an earlier run to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown over the baseline reported as a regression")
+    parser.add_argument("-n", "--points", help="comma separated dataset sizes")
+    parser.add_argument("-m", "--modes", help="comma separated modes")
+    parser.add_argument("-e", "--engines", help="comma separated engines")
+    parser.add_argument("-s", "--scales", help="comma separated scales")
+    parser.add_argument("-r", "--radii", help="comma separated radii")
+    parser.add_argument("-c", "--categories", type=int, default=5)
+    parser.add_argument("-cl", "--clusters", type=int, default=0,
+                        help="amount of clusters, points are spread evenly if 0")
+    parser.add_argument("-rep", "--repeat", type=int, default=3,
+                        help="runs of each case, the fastest one being kept")
+    parser.add_argument("-nr", "--no_render", action="store_true")
+    args = parser.parse_args()
+
+    settings = {"points": parse_list(args.points, int) or DEFAULT_POINTS,
+                "modes": parse_list(args.modes, str.lower) or MODES,
+                "engines": parse_list(args.engines, str.lower) or ENGINES,
+                "scales": parse_list(args.scales, float) or DEFAULT_SCALES,
+                "radii": parse_list(args.radii, float) or DEFAULT_RADII,
+                "categories": args.categories, "clusters": args.clusters,
+                "repeat": args.repeat}
+    assert all(mode in MODES for mode in settings["modes"]), "invalid mode"
+    assert all(engine in ENGINES for engine in settings["engines"]), "invalid engine"
+
+    results = run_benchmarks(render=not args.no_render, verbose=args.verbose, **settings)
+    write_results(args.output, results, settings)
+    print("{} case(s) written to {}".format(len(results), args.output))
+
+    if args.baseline:
+        regressions = compare(results, read_results(args.baseline), args.threshold)
+        for name, before, after in regressions:
+            print("Regression: {} {:.4f}s -> {:.4f}s ({:+.0%})".format(
+                  name, before, after, after / before - 1))
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions against {}".format(args.baseline))
+
+if __name__ == "__main__":
+    main()
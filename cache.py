@@ -0,0 +1,282 @@
+"""
+on-disk caches for heatmap
+
+Entries are directories of .npy files plus a meta.json file, so their
+arrays can be memory mapped straight back in instead of being parsed.
+"""
+from typing import Dict, Union
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from utilities import Dataset, load_columns, verify_dataset
+from sparse import SparseGrid
+from compact import ENCODINGS, SplitGrid
+
+DEFAULT_CACHE_BYTES = 1 << 30
+META_FILE = "meta.json"
+
+
+def file_digest(filepath: str) -> str:
+    """
+    Returns a hash of the contents of the file
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_key(*parts: object) -> str:
+    """
+    Returns a cache key made from the given parts
+    """
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class DirectoryCache:
+    """
+    Cache of array entries stored in a directory, evicting the least
+    recently used entries once the entries take up more than max_bytes
+
+    root - directory holding the entries
+    max_bytes - size the entries are trimmed down to after a store
+    hits - amount of lookups that found their entry
+    misses - amount of lookups that did not find their entry
+    bytes_stored - amount of bytes written to the cache
+    """
+    root: str
+    max_bytes: int
+    hits: int
+    misses: int
+    bytes_stored: int
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        """
+        Initializes a cache in root, creating the directory if needed
+        """
+        self.root, self.max_bytes = root, max_bytes
+        self.hits = self.misses = self.bytes_stored = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> Union[tuple, None]:
+        """
+        Returns the memory mapped arrays and the metadata of an entry,
+        or None if there is no such entry
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, META_FILE)) as file:
+                meta = json.load(file)
+            arrays = {name: np.load(os.path.join(entry, name + ".npy"),
+                                    mmap_mode="r")
+                      for name in meta["arrays"]}
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # the modification time of an entry tracks when it was last used
+        os.utime(entry)
+        return arrays, meta["meta"]
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray], meta: dict) -> int:
+        """
+        Stores the arrays and metadata under key, returns the bytes written
+        """
+        entry = self._entry(key)
+        # a staging directory of its own, as threads of one process can
+        # store the same entry at once
+        partial = tempfile.mkdtemp(prefix=key + ".", suffix=".part", dir=self.root)
+        for name, array in arrays.items():
+            np.save(os.path.join(partial, name + ".npy"), array)
+        with open(os.path.join(partial, META_FILE), "w") as file:
+            json.dump({"arrays": list(arrays), "meta": meta}, file)
+        self.invalidate(key)
+        try:
+            os.rename(partial, entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(partial, ignore_errors=True)
+        size = self._size(entry)
+        self.bytes_stored += size
+        self.evict()
+        return size
+
+    def invalidate(self, key: str) -> None:
+        """
+        Removes an entry
+        """
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def clear(self) -> None:
+        """
+        Removes every entry
+        """
+        for key in os.listdir(self.root):
+            self.invalidate(key)
+
+    def _size(self, entry: str) -> int:
+        try:
+            return sum(os.path.getsize(os.path.join(entry, name))
+                       for name in os.listdir(entry))
+        except OSError:
+            return 0
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the
+        entries take up at most max_bytes
+        """
+        entries = []
+        for key in os.listdir(self.root):
+            entry = self._entry(key)
+            if key.endswith(".part") or not os.path.isdir(entry):
+                continue
+            entries.append((os.path.getmtime(entry), self._size(entry), key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
+
+
+class DatasetCache(DirectoryCache):
+    """
+    Cache of the columns loaded from csv files, keyed by the contents
+    of the file and the columns and mode it was loaded with, so that
+    editing a file never serves its outdated columns
+    """
+
+    def dataset_key(self, filepath: str, name_col: int, lat_col: int,
+                    lon_col: int, value_col: int, mode: str) -> str:
+        """
+        Returns the key of a dataset
+        """
+        verify_dataset(filepath)
+        return make_key(file_digest(filepath), name_col, lat_col,
+                        lon_col, value_col, mode)
+
+    def load(self, filepath: str, name_col: int, lat_col: int,
+             lon_col: int, value_col: int, mode: str,
+             key: Union[str, None] = None) -> Dataset:
+        """
+        Returns the dataset from the cache, loading and storing it on a miss
+        key can be passed in when the caller already has the dataset_key
+        """
+        key = (self.dataset_key(filepath, name_col, lat_col, lon_col, value_col, mode)
+               if key == None else key)
+        found = self.get(key)
+        if found != None:
+            arrays, meta = found
+            return Dataset(arrays["names"], arrays["lats"], arrays["lons"],
+                           arrays["values"], arrays["rows"], meta["categories"],
+                           meta["value_label"])
+        data = load_columns(filepath, name_col, lat_col, lon_col, value_col, mode)
+        self.put(key, {"names": data.names, "lats": data.lats, "lons": data.lons,
+                       "values": data.values, "rows": data.rows},
+                 {"categories": data.categories, "value_label": data.value_label})
+        return data
+
+
+class GridCache(DirectoryCache):
+    """
+    Cache of computed grids, keyed by everything that changes a grid:
+    the dataset, mode, scale, radius, border offsets, adaptive tolerance,
+    the encoding the cells are stored in and whether they are sparse, so
+    that a grid always comes back stored the way it was asked for.
+    Display settings such as the colourmap or legend do not affect the key.
+    """
+
+    def grid_key(self, fingerprint: str, mode: str, scale: float, radius: float,
+                 border_offset: float, north_offset: float, south_offset: float,
+                 east_offset: float, west_offset: float,
+                 tolerance: Union[float, None] = None,
+                 encoding: str = ENCODINGS[0], sparse: bool = False) -> str:
+        """
+        Returns the key of a grid, fingerprint being the key of its dataset
+        and tolerance that of the adaptive refinement of the grid, if any
+        """
+        parts = [] if tolerance == None else [tolerance]
+        # dense float64 grids keep the keys they had before encodings existed
+        parts += [] if encoding == ENCODINGS[0] else [encoding]
+        parts += ["sparse"] if sparse else []
+        return make_key(fingerprint, mode, scale, radius, border_offset,
+                        north_offset, south_offset, east_offset, west_offset, *parts)
+
+    def load_grid(self, key: str) -> Union[np.ndarray, SparseGrid, SplitGrid, None]:
+        """
+        Returns the memory mapped grid stored under key, or None on a miss
+        Sparse grids come back sparse, their tiles memory mapped, and split
+        grids come back split, their planes memory mapped
+        """
+        found = self.get(key)
+        if found == None:
+            return None
+        arrays, meta = found
+        if "sparse" in meta:
+            shape, tile = meta["sparse"]
+            return SparseGrid.from_arrays(shape, tile, arrays["keys"], arrays["tiles"])
+        if "split" in meta:
+            return SplitGrid(arrays["categories"].shape, meta["split"],
+                             arrays["categories"], arrays["fades"])
+        return arrays["grid"]
+
+    def store_grid(self, key: str, grid: Union[np.ndarray, SparseGrid, SplitGrid]) -> int:
+        """
+        Stores the grid under key, returns the bytes written
+        Only the stored tiles of sparse grids are written, and the planes
+        of split grids
+        """
+        if isinstance(grid, SparseGrid):
+            keys, tiles = grid.to_arrays()
+            return self.put(key, {"keys": keys, "tiles": tiles},
+                            {"sparse": [list(grid.shape), grid.tile]})
+        if isinstance(grid, SplitGrid):
+            return self.put(key, {"categories": grid.categories, "fades": grid.fades},
+                            {"split": grid.encoding})
+        return self.put(key, {"grid": grid}, {})
+
+
+class BackgroundCache(DirectoryCache):
+    """
+    Cache of rendered map backgrounds, keyed by everything that changes
+    how the map features are drawn: the extent, projection, resolution,
+    figure size, dpi and whether space is kept for a colourbar
+    """
+
+    def background_key(self, extent: tuple, projection: str, resolution: str,
+                       figsize: tuple, dpi: int, colourbar: bool) -> str:
+        """
+        Returns the key of a background
+        """
+        return make_key(list(extent), projection, resolution, list(figsize),
+                        dpi, colourbar)
+
+    def load_background(self, key: str) -> Union[tuple, None]:
+        """
+        Returns the raster, map position and colourbar position stored
+        under key, or None on a miss
+        """
+        found = self.get(key)
+        if found == None:
+            return None
+        arrays, meta = found
+        colourbar = meta["colourbar"]
+        return (arrays["raster"], tuple(meta["position"]),
+                None if colourbar == None else tuple(colourbar))
+
+    def store_background(self, key: str, raster: np.ndarray, position: tuple,
+                         colourbar: Union[tuple, None]) -> int:
+        """
+        Stores the background under key, returns the bytes written
+        """
+        return self.put(key, {"raster": raster},
+                        {"position": list(position),
+                         "colourbar": None if colourbar == None else list(colourbar)})
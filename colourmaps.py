@@ -1,9 +1,16 @@
 """
 colourmaps module for heatmap
 """
-from matplotlib.colors import LinearSegmentedColormap
+from typing import TYPE_CHECKING, Union
+from functools import lru_cache
 import numpy as np
 from math import floor, ceil, modf
+from compact import SplitGrid
+# matplotlib takes a while to import, so it is only imported once something
+# is drawn, here and in the modules drawing maps, its types being imported
+# for annotations alone
+if TYPE_CHECKING:
+    from matplotlib.colors import Colormap, LinearSegmentedColormap
 
 # defines how many colours there are and which colours they are
 # must be updated every time a colour is added to _unified_map
@@ -100,10 +107,112 @@ _unified_map = {'red': ((0., 0.36, 0.36),
                          (0.90001, 1, 1),
                          (0.90001, 0, 0),
                          (1, 1, 1))}
+# the fades of _unified_map start this far past each whole value
+FADE_OFFSET = 0.0001
 
-def get_unified_colourmap() -> LinearSegmentedColormap:
+@lru_cache(maxsize=None)
+def get_unified_colourmap() -> "LinearSegmentedColormap":
     """Returns an adjusted version of the unified colourmap
     according to the number provided
+    Built once, every call returns the same colourmap
     """
+    from matplotlib.colors import LinearSegmentedColormap
+
     unified_cmap = LinearSegmentedColormap('unified_cmap', _unified_map, N=100000)
     return unified_cmap
+
+
+@lru_cache(maxsize=None)
+def _colour_table() -> np.ndarray:
+    """
+    Returns COLOURS as rows of red, green and blue bytes
+    """
+    table = np.array([[int(colour[i:i + 2], 16) for i in (1, 3, 5)]
+                      for colour in COLOURS], dtype=np.uint8)
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=32)
+def _colourmap_table(colourmap: Union[str, "Colormap"]) -> np.ndarray:
+    """
+    Returns the lookup table of a matplotlib colourmap as rgba bytes
+    """
+    from matplotlib import colormaps
+
+    cmap = colormaps[colourmap] if isinstance(colourmap, str) else colourmap
+    table = cmap(np.arange(cmap.N), bytes=True)
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=None)
+def _fade_table(levels: int) -> np.ndarray:
+    """
+    Returns the alpha byte of each quantized fade of split grids
+    """
+    table = (np.clip(np.arange(levels + 1) / levels - FADE_OFFSET, 0.0, 1.0) *
+             255).astype(np.uint8)
+    table.flags.writeable = False
+    return table
+
+
+def split_rgba(grid: SplitGrid) -> np.ndarray:
+    """
+    Converts a split influence grid straight to rgba bytes from its planes,
+    like influence_rgba does with the values they decode to
+    """
+    rgba = np.empty(grid.shape + (4,), dtype=np.uint8)
+    index = np.clip(grid.categories.astype(np.intp) - 1, 0, len(COLOURS) - 1)
+    rgba[..., :3] = _colour_table()[index]
+    # cells no legend number dominates have a fade of 0, which is transparent
+    rgba[..., 3] = _fade_table(grid.levels)[grid.fades]
+    return rgba
+
+
+def influence_rgba(grid: Union[np.ndarray, SplitGrid]) -> np.ndarray:
+    """
+    Converts an influence grid straight to rgba bytes, the way the unified
+    colourmap shows it: a value in (n - 1, n] takes the nth colour of
+    COLOURS, faded in by how far it is past n - 1, with 0 transparent
+    """
+    if isinstance(grid, SplitGrid):
+        return split_rgba(grid)
+    grid = np.asarray(grid, dtype=float) - FADE_OFFSET
+    index = np.clip(np.nan_to_num(np.ceil(grid) - 1), 0, len(COLOURS) - 1).astype(np.intp)
+    rgba = np.empty(grid.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = _colour_table()[index]
+    fade = np.clip(grid - index, 0.0, 1.0)
+    fade[np.isnan(grid)] = 0.0
+    rgba[..., 3] = fade * 255
+    return rgba
+
+
+def weighted_rgba(grid: np.ndarray, colourmap: Union[str, "Colormap"] = "viridis_r",
+                  vmin: Union[float, None] = None,
+                  vmax: Union[float, None] = None) -> np.ndarray:
+    """
+    Converts a weighted grid straight to rgba bytes through the lookup
+    table of a colourmap, scaled from vmin to vmax, which default to the
+    smallest and biggest values like imshow does
+    """
+    grid = np.asarray(grid, dtype=float)
+    table = _colourmap_table(colourmap)
+    vmin = np.nanmin(grid) if vmin == None else vmin
+    vmax = np.nanmax(grid) if vmax == None else vmax
+    scaled = (grid - vmin) / (vmax - vmin) if vmax > vmin else np.zeros(grid.shape)
+    index = np.clip(np.nan_to_num(scaled * len(table)), 0, len(table) - 1)
+    rgba = table[index.astype(np.intp)]
+    rgba[np.isnan(grid)] = 0
+    return rgba
+
+
+def grid_to_rgba(grid: Union[np.ndarray, SplitGrid], mode: str,
+                 colourmap: Union[str, "Colormap"] = "viridis_r") -> np.ndarray:
+    """
+    Converts a grid of the given mode straight to rgba bytes,
+    the colourmap only applying to weighted grids
+    """
+    if mode == "influence":
+        return influence_rgba(grid)
+    return weighted_rgba(grid, colourmap)
@@ -0,0 +1,154 @@
+"""
+compact grids module for heatmap
+
+Grids are computed in float64, but an influence cell only holds a legend
+number and how far it is faded in, which a SplitGrid stores as a plane of
+bytes and a plane of quantized fades, taking 2 or 3 bytes per cell instead
+of 8. Weighted grids can be kept in float32 instead. Cells are encoded as
+they are written and decoded as they are read, the maps drawn from them
+looking the same.
+"""
+from typing import Tuple, Union
+import numpy as np
+
+# how the cells of the grids are stored, float64 being exact
+ENCODINGS = ["float64", "float32", "uint8", "uint16"]
+# encodings splitting influence grids into a legend number and a fade
+SPLIT_ENCODINGS = {"uint8": np.uint8, "uint16": np.uint16}
+# bytes each cell of a grid takes up in each encoding
+CELL_BYTES = {"float64": 8, "float32": 4, "uint8": 2, "uint16": 3}
+
+
+def encode_split(values: np.ndarray, encoding: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the legend numbers and quantized fades of influence values
+    A value in (n - 1, n] is legend number n faded in by how far it is past
+    n - 1, which is kept to at least one level so that it still shows n
+    """
+    dtype = SPLIT_ENCODINGS[encoding]
+    levels = np.iinfo(dtype).max
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    categories = np.maximum(np.ceil(values), 0)
+    fades = np.where(categories > 0,
+                     np.clip(np.rint((values - categories + 1) * levels), 1, levels), 0)
+    return categories.astype(np.uint8), fades.astype(dtype)
+
+
+def decode_split(categories: np.ndarray, fades: np.ndarray) -> np.ndarray:
+    """
+    Returns the influence values of legend numbers and quantized fades
+    """
+    levels = np.iinfo(fades.dtype).max
+    return np.where(categories > 0, categories - 1.0 + fades / levels, 0.0)
+
+
+class SplitGrid:
+    """
+    Influence grid, or stack of grids, stored as a plane of legend numbers
+    and a plane of fades quantized to the levels of an unsigned integer
+    Writing float values into it encodes them, reading cells decodes them
+
+    encoding - one of SPLIT_ENCODINGS, the type the fades are stored in
+    categories - legend number dominating each cell, 0 where none does
+    fades - how far each cell is faded in, from 1 to levels, 0 where no
+            legend number dominates
+    """
+    encoding: str
+    categories: np.ndarray
+    fades: np.ndarray
+
+    dtype = np.dtype(float)
+
+    def __init__(self, shape: Tuple[int, ...], encoding: str = "uint8",
+                 categories: Union[np.ndarray, None] = None,
+                 fades: Union[np.ndarray, None] = None) -> None:
+        """
+        Initializes split grids of the given shape, every cell being 0
+        unless their planes are given
+        """
+        assert encoding in SPLIT_ENCODINGS, "invalid split encoding"
+        self.encoding = encoding
+        self.categories = (np.zeros(shape, dtype=np.uint8) if categories is None
+                           else categories)
+        self.fades = (np.zeros(shape, dtype=SPLIT_ENCODINGS[encoding]) if fades is None
+                      else fades)
+        assert self.categories.shape == self.fades.shape, "planes of different shapes"
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """
+        Get the shape of the grids
+        """
+        return self.categories.shape
+
+    @property
+    def ndim(self) -> int:
+        """
+        Get the amount of dimensions of the grids
+        """
+        return self.categories.ndim
+
+    @property
+    def size(self) -> int:
+        """
+        Get the amount of cells of the grids
+        """
+        return self.categories.size
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Get the amount of bytes the planes take up
+        """
+        return self.categories.nbytes + self.fades.nbytes
+
+    @property
+    def levels(self) -> int:
+        """
+        Get the fade of a cell fully faded in
+        """
+        return int(np.iinfo(self.fades.dtype).max)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> Union["SplitGrid", np.ndarray]:
+        """
+        Returns one grid of a stack, sharing its planes, when key is an
+        integer, the decoded cells picked by key otherwise
+        """
+        if isinstance(key, (int, np.integer)) and self.ndim > 2:
+            return SplitGrid(self.shape[1:], self.encoding,
+                             self.categories[key], self.fades[key])
+        return decode_split(self.categories[key], self.fades[key])
+
+    def __setitem__(self, key, values: np.ndarray) -> None:
+        """
+        Encodes values into the cells picked by key
+        """
+        self.categories[key], self.fades[key] = encode_split(values, self.encoding)
+
+    def __iter__(self):
+        return (self[grid] for grid in range(len(self)))
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        dense = decode_split(self.categories, self.fades)
+        return dense if dtype == None else dense.astype(dtype)
+
+    def copy(self) -> "SplitGrid":
+        """
+        Returns a writeable copy of the grids
+        """
+        return SplitGrid(self.shape, self.encoding, np.array(self.categories),
+                         np.array(self.fades))
+
+
+def empty_grid(shape: Tuple[int, ...], encoding: str = ENCODINGS[0]
+               ) -> Union[np.ndarray, SplitGrid]:
+    """
+    Returns grids of the given shape stored in an encoding, every cell being 0
+    """
+    assert encoding in ENCODINGS, "invalid encoding"
+    if encoding in SPLIT_ENCODINGS:
+        return SplitGrid(shape, encoding)
+    return np.full(shape, 0.0, dtype=encoding)
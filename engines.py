@@ -0,0 +1,636 @@
+"""
+grid engines module for heatmap
+
+Every engine fills a rectangular window of one or more grids from a
+GridPoints: the grid coordinates of the points and a payload matrix
+holding one row per point. In influence mode the payload has one column
+per value of each grid, holding how many times the point has that value.
+In weighted mode it has one column per grid, holding the point's value.
+"""
+from typing import Callable, Iterable, List, Sequence, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from functools import lru_cache
+import os
+from math import sqrt, floor
+import numpy as np
+from utilities import Counter
+from spatial import SpatialIndex
+from sparse import SparseGrid
+
+ENGINES = ["vectorized", "splat", "loop"]
+# maximum amount of cell/point pairs evaluated at once by the vectorized
+# engine, keeps the temporary distance arrays at a few dozen megabytes
+BLOCK_SIZE = 2 ** 21
+# amount of grid rows filled per call to an engine
+BAND_ROWS = 16
+# influence weight layers add up in double precision like the loop engine
+# does, so that the engines agree on ties. They only span a band of rows
+LAYER_DTYPE = np.float64
+# marks a value without any point in range of a cell
+ABSENT = np.iinfo(np.int32).max
+# distance field of the splat kernels, grown to the largest radius used
+_distances = np.zeros((1, 1))
+# amount of splat kernels kept for reuse
+KERNEL_CACHE = 8
+
+
+class GridPoints:
+    """
+    Points handed to the grid engines
+
+    mode - data parsing mode of the grids
+    xs - grid x coordinates of the points
+    ys - grid y coordinates of the points
+    payload - per point values, see the module docstring
+    legend_values - legend number of each payload column (influence mode)
+    groups - grid each payload column belongs to
+    order - rank of each payload entry used to break ties, in the order the
+            values were read in, the point index is used instead if None
+    entries - point, payload column and rank of every value read in, for points
+              whose payload counts several of them (influence mode), so that the
+              loop engine can add up their weights one at a time like they were
+              read in, None if every count stands for one value
+    """
+    mode: str
+    xs: np.ndarray
+    ys: np.ndarray
+    payload: np.ndarray
+    legend_values: np.ndarray
+    groups: np.ndarray
+    order: Union[np.ndarray, None]
+    entries: Union[np.ndarray, None]
+
+    def __init__(self, mode: str, xs: np.ndarray, ys: np.ndarray,
+                 payload: np.ndarray, legend_values: Union[np.ndarray, None] = None,
+                 groups: Union[np.ndarray, None] = None,
+                 order: Union[np.ndarray, None] = None,
+                 entries: Union[np.ndarray, None] = None) -> None:
+        """
+        Initializes the points, by default every payload column is its own grid
+        """
+        self.mode, self.xs, self.ys, self.payload = mode, xs, ys, payload
+        columns = payload.shape[1]
+        self.legend_values = (np.ones(columns) if legend_values is None
+                              else legend_values)
+        self.groups = np.arange(columns) if groups is None else groups
+        self.order, self.entries = order, entries
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    @property
+    def grids(self) -> int:
+        """
+        Amount of grids the points fill in
+        """
+        return int(self.groups.max()) + 1 if len(self.groups) else 1
+
+    def rank(self, point_i: int, value: int) -> int:
+        """
+        Returns the tie breaking rank of a value of a point
+        """
+        return point_i if self.order is None else self.order[point_i, value]
+
+    def subset(self, indices: np.ndarray) -> "GridPoints":
+        """
+        Returns the given points only, keeping their relative order
+        """
+        entries = None
+        if self.entries is not None:
+            position = np.full(len(self), -1)
+            position[indices] = np.arange(len(position[indices]))
+            entries = self.entries[position[self.entries[:, 0]] >= 0]
+            entries[:, 0] = position[entries[:, 0]]
+        return GridPoints(self.mode, self.xs[indices], self.ys[indices],
+                          self.payload[indices], self.legend_values, self.groups,
+                          None if self.order is None else self.order[indices], entries)
+
+
+def window_points(xs: np.ndarray, ys: np.ndarray, radius: float,
+                  rows: Tuple[int, int], cols: Tuple[int, int],
+                  index: Union[SpatialIndex, None] = None) -> np.ndarray:
+    """
+    Returns the sorted indices of the points whose radius reaches into the window
+    index is used to look the points up if provided, otherwise all are checked
+    """
+    if index != None:
+        return index.query_box(cols[0] - radius, cols[1] - 1 + radius,
+                               rows[0] - radius, rows[1] - 1 + radius)
+    return np.flatnonzero((xs >= cols[0] - radius) & (xs <= cols[1] - 1 + radius) &
+                          (ys >= rows[0] - radius) & (ys <= rows[1] - 1 + radius))
+
+
+class InfluenceLayers:
+    """
+    Per value weight layers of a window of an influence grid
+
+    weights - summed weight of each value in each cell, one layer per value
+    first - rank of the first point of each value in range of each cell,
+            or ABSENT if there is no such point
+    """
+    weights: np.ndarray
+    first: np.ndarray
+
+    def __init__(self, values: int, height: int, width: int,
+                 dtype: type = LAYER_DTYPE) -> None:
+        """
+        Initializes empty layers for the given amount of values
+        """
+        self.weights = np.zeros((values, height, width), dtype=dtype)
+        self.first = np.full((values, height, width), ABSENT, dtype=np.int32)
+
+    def add(self, value: int, rank: int, area: Tuple[slice, slice],
+            weights: np.ndarray, in_range: np.ndarray) -> None:
+        """
+        Adds the weights of a point to the cells in area of the value's layer
+        Points have to be added in order for the weights to add up the same
+        way as they would one cell at a time
+        """
+        self.weights[value][area] += weights
+        first = self.first[value][area]
+        first[in_range & (first > rank)] = rank
+
+    def resolve(self, legend_values: np.ndarray, groups: np.ndarray,
+                grids: int) -> np.ndarray:
+        """
+        Turns the layers into influence grid values, resolving the
+        layers belonging to each grid separately
+        """
+        return np.stack([self._resolve(np.flatnonzero(groups == group),
+                                       legend_values)
+                         for group in range(grids)])
+
+    def _resolve(self, layers: np.ndarray, legend_values: np.ndarray) -> np.ndarray:
+        """
+        Turns the given layers into the values of one influence grid
+
+        The value with the highest weight dominates the cell, and is faded
+        out by the sum of the weights of the other values in the cell.
+        Only values with a point in range of the cell can dominate it, and
+        ties go to the value that reached the cell first.
+        """
+        grid = np.full(self.weights.shape[1:], 0.0)
+        if not len(layers):
+            return grid
+        legend_values = legend_values[layers]
+        # resolved a few rows at a time to keep the float64 temporaries small
+        step = max(1, BLOCK_SIZE // (len(layers) * max(1, grid.shape[1])))
+        for row in range(0, grid.shape[0], step):
+            rows = slice(row, row + step)
+            sums = self.weights[layers, rows]
+            first = self.first[layers, rows]
+            present = first != ABSENT
+            masked = np.where(present, sums, -np.inf)
+            tied = present & (masked == masked.max(axis=0))
+            dominant = np.where(tied, first, ABSENT).argmin(axis=0)[None]
+            d_weight = np.take_along_axis(sums, dominant, axis=0)[0]
+            others = np.where(present, sums, 0.0)
+            np.put_along_axis(others, dominant, 0.0, axis=0)
+            rest = others.sum(axis=0)
+            total_weight = d_weight - rest
+            legend = legend_values[dominant[0]]
+            block = np.where(total_weight >= 0.999, legend,
+                             legend - (0.999 - total_weight))
+            block[~present.any(axis=0) | (d_weight < rest)] = 0.0
+            grid[rows] = block
+        return grid
+
+
+def _vectorized_windows(points: GridPoints, radii: Sequence[float],
+                        rows: Tuple[int, int], cols: Tuple[int, int],
+                        near: np.ndarray) -> List[np.ndarray]:
+    """
+    Fills the window for each radius with broadcast distance computations
+    over blocks of rows, the distances being computed once for all radii
+    """
+    return _vectorized_cells(points, radii, np.arange(rows[0], rows[1]),
+                             np.arange(cols[0], cols[1]), near)
+
+
+def _vectorized_cells(points: GridPoints, radii: Sequence[float],
+                      row_cells: np.ndarray, col_cells: np.ndarray,
+                      near: np.ndarray) -> List[np.ndarray]:
+    """
+    Computes the cells at every combination of the given rows and columns
+    for each radius, like _vectorized_windows does for the cells of a window
+    """
+    height, width = len(row_cells), len(col_cells)
+    influence = points.mode == "influence"
+    payload = points.payload
+    if influence:
+        layers = [InfluenceLayers(payload.shape[1], height, width) for _ in radii]
+    else:
+        grids = [np.full((payload.shape[1], height, width), 0.0) for _ in radii]
+
+    if len(near):
+        block = max(1, BLOCK_SIZE // (width * len(near)))
+        dx_sq = (points.xs[near, None] - col_cells[None, :]) ** 2
+        for start in range(0, height, block):
+            stop = min(start + block, height)
+            area = (slice(start, stop), slice(None))
+            dy_sq = (points.ys[near, None] - row_cells[None, start:stop]) ** 2
+            dist = np.sqrt(dx_sq[:, None, :] + dy_sq[:, :, None])
+            for radius_i, radius in enumerate(radii):
+                in_range = dist <= radius
+                weights = np.where(in_range, 0.999 - dist / radius, 0.0)
+                if not influence:
+                    grids[radius_i][(slice(None),) + area] = np.tensordot(
+                        payload[near], weights, axes=(0, 0))
+                    continue
+                # added point by point so that the weights add up in the
+                # same order as they would one cell at a time
+                for point_weights, point_range, point_i in zip(weights, in_range, near):
+                    if not point_range.any():
+                        continue
+                    for value in np.flatnonzero(payload[point_i]):
+                        layers[radius_i].add(value, points.rank(point_i, value), area,
+                                             point_weights * payload[point_i, value],
+                                             point_range)
+
+    if influence:
+        return [radius_layers.resolve(points.legend_values, points.groups, points.grids)
+                for radius_layers in layers]
+    return grids
+
+
+def _vectorized_window(points: GridPoints, radius: float, rows: Tuple[int, int],
+                       cols: Tuple[int, int], near: np.ndarray) -> np.ndarray:
+    """
+    Fills the window with broadcast distance computations over blocks of rows
+    """
+    return _vectorized_windows(points, [radius], rows, cols, near)[0]
+
+
+def _distance_field(reach: int) -> np.ndarray:
+    """
+    Returns the distance of each cell within reach of a point to the point,
+    with the point sitting in the middle of the array
+    Cut out of the field of the largest reach asked for so far
+    """
+    global _distances
+    if _distances.shape[0] // 2 < reach:
+        offsets = np.arange(-reach, reach + 1)
+        _distances = np.sqrt(offsets[None, :] ** 2 + offsets[:, None] ** 2)
+        _distances.flags.writeable = False
+    middle = _distances.shape[0] // 2
+    return _distances[middle - reach:middle + reach + 1, middle - reach:middle + reach + 1]
+
+
+def reserve_radius(radius: float) -> None:
+    """
+    Computes the distance field of the given radius (in grid cells) up
+    front, so that the kernels of smaller radii are all cut out of it
+    """
+    _distance_field(floor(radius))
+
+
+@lru_cache(maxsize=KERNEL_CACHE)
+def _kernel(radius: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the weights and the in range mask of the cells around a point,
+    with the point sitting in the middle of the arrays
+    """
+    dist = _distance_field(floor(radius))
+    in_range = dist <= radius
+    weights = np.where(in_range, 0.999 - dist / radius, 0.0)
+    weights.flags.writeable = in_range.flags.writeable = False
+    return weights, in_range
+
+
+def _splat_window(points: GridPoints, radius: float, rows: Tuple[int, int],
+                  cols: Tuple[int, int], near: np.ndarray) -> np.ndarray:
+    """
+    Fills the window by stamping the weight kernel of every point around it
+    """
+    height, width = rows[1] - rows[0], cols[1] - cols[0]
+    influence = points.mode == "influence"
+    payload = points.payload
+    if influence:
+        layers = InfluenceLayers(payload.shape[1], height, width)
+    else:
+        grid = np.full((payload.shape[1], height, width), 0.0)
+    kernel, kernel_range = _kernel(radius)
+    reach = kernel.shape[0] // 2
+
+    for point_i in near:
+        x, y = points.xs[point_i], points.ys[point_i]
+        # overlap between the kernel around the point and the window
+        top, bottom = max(y - reach, rows[0]), min(y + reach + 1, rows[1])
+        left, right = max(x - reach, cols[0]), min(x + reach + 1, cols[1])
+        area = (slice(top - rows[0], bottom - rows[0]),
+                slice(left - cols[0], right - cols[0]))
+        stamp = (slice(top - y + reach, bottom - y + reach),
+                 slice(left - x + reach, right - x + reach))
+        if not influence:
+            grid[(slice(None),) + area] += (kernel[stamp][None] *
+                                            payload[point_i][:, None, None])
+            continue
+        for value in np.flatnonzero(payload[point_i]):
+            layers.add(value, points.rank(point_i, value), area,
+                       kernel[stamp] * payload[point_i, value], kernel_range[stamp])
+
+    if influence:
+        return layers.resolve(points.legend_values, points.groups, points.grids)
+    return grid
+
+
+def _loop_window(points: GridPoints, radius: float, rows: Tuple[int, int],
+                 cols: Tuple[int, int], near: np.ndarray) -> np.ndarray:
+    """
+    Fills the window one cell at a time, checking every nearby point for each cell
+    """
+    grid = np.full((points.grids, rows[1] - rows[0], cols[1] - cols[0]), 0.0)
+    near = near.tolist()
+    xs, ys = points.xs.tolist(), points.ys.tolist()
+    payload_rows = points.payload.tolist()
+    groups = points.groups.tolist()
+    legend_values = points.legend_values.tolist()
+    # values of each point by grid, in the order they were read in
+    if points.entries is None:
+        point_values = [[sorted([(points.rank(point_i, value), value, count)
+                                 for value, count in enumerate(row)
+                                 if count and groups[value] == group])
+                         for group in range(points.grids)]
+                        for point_i, row in enumerate(payload_rows)]
+    else:
+        point_values = [[[] for _ in range(points.grids)] for _ in payload_rows]
+        for point_i, value, rank in sorted(points.entries.tolist(), key=lambda e: e[2]):
+            point_values[point_i][groups[value]].append((rank, value, 1))
+    for i in range(rows[0], rows[1]):
+        for j in range(cols[0], cols[1]):
+            vicinity = [[point_i,
+                        sqrt((xs[point_i] - j) ** 2 +
+                        (ys[point_i] - i) ** 2)]
+                        for point_i in near]
+            if not [item for item in vicinity if item[1] <= radius]:
+                continue
+            vicinity = [[point_i, 0.999 - point_dist / radius]
+                        for point_i, point_dist in vicinity
+                        if point_dist <= radius]
+            for group in range(points.grids):
+                # influence mode
+                if points.mode == "influence":
+                    entries = sorted([(rank, value, weighted_dist * count)
+                                      for point_i, weighted_dist in vicinity
+                                      for rank, value, count
+                                      in point_values[point_i][group]])
+                    if not entries:
+                        continue
+                    weights = Counter()
+                    for _, value, weight in entries:
+                        weights[value] += weight
+                    weights = list(weights.items())
+                    weights.sort(key=lambda item: item[1], reverse=True)
+                    dominant = weights[0]
+                    d_value = dominant[0]
+                    d_weight = dominant[1]
+                    # sum of the other weights
+                    rest = sum([weight for value, weight in weights[1:]])
+                    if not d_weight < rest:
+                        total_weight = d_weight - rest
+                        grid[group][i - rows[0]][j - cols[0]] = (
+                            legend_values[d_value]
+                            if total_weight >= 0.999
+                            else legend_values[d_value] - (0.999 - total_weight))
+                # weighted mode
+                elif points.mode == "weighted":
+                    total_count = 0
+                    for point_i, weighted_dist in vicinity:
+                        total_count += weighted_dist * payload_rows[point_i][group]
+                    grid[group][i - rows[0]][j - cols[0]] = total_count
+    return grid
+
+
+_ENGINE_FUNCTIONS = {"vectorized": _vectorized_window, "splat": _splat_window,
+                     "loop": _loop_window}
+
+
+def compute_window(engine: str, points: GridPoints, radius: float,
+                   rows: Tuple[int, int], cols: Tuple[int, int],
+                   index: Union[SpatialIndex, None] = None) -> np.ndarray:
+    """
+    Computes the values of the cells in rows[0]:rows[1], cols[0]:cols[1]
+    of every grid, stacked along the first axis
+
+    radius - search radius in grid cells
+    index - spatial index over the points used to find the nearby points
+    """
+    return compute_windows(engine, points, [radius], rows, cols, index)[0]
+
+
+def compute_windows(engine: str, points: GridPoints, radii: Sequence[float],
+                    rows: Tuple[int, int], cols: Tuple[int, int],
+                    index: Union[SpatialIndex, None] = None) -> List[np.ndarray]:
+    """
+    Computes the window of every grid for each radius, looking up the
+    points near the window only once, at the largest radius
+    The vectorized engine also computes the distances only once
+    """
+    assert engine in ENGINES, "unknown engine {}".format(engine)
+    near = window_points(points.xs, points.ys, max(radii), rows, cols, index)
+    if engine == "vectorized":
+        return _vectorized_windows(points, radii, rows, cols, near)
+    windows = []
+    for radius in radii:
+        reaching = near[window_points(points.xs[near], points.ys[near],
+                                      radius, rows, cols)]
+        windows.append(_ENGINE_FUNCTIONS[engine](points, radius, rows, cols, reaching))
+    return windows
+
+
+def sample_cells(points: GridPoints, radius: float, row_cells: np.ndarray,
+                 col_cells: np.ndarray,
+                 index: Union[SpatialIndex, None] = None) -> np.ndarray:
+    """
+    Computes the cells at every combination of the given rows and columns
+    of every grid with the vectorized engine, like a window made of only
+    those rows and columns
+
+    radius - search radius in grid cells
+    index - spatial index over the points used to find the nearby points
+    """
+    row_cells, col_cells = np.asarray(row_cells), np.asarray(col_cells)
+    near = window_points(points.xs, points.ys, radius,
+                         (int(row_cells.min()), int(row_cells.max()) + 1),
+                         (int(col_cells.min()), int(col_cells.max()) + 1), index)
+    return _vectorized_cells(points, [radius], row_cells, col_cells, near)[0]
+
+
+class GridFile:
+    """
+    Stack of grids stored on disk as a .npy file, written a band of rows
+    at a time so that the grids never have to be held in memory
+
+    path - location of the file
+    shape - amount of grids and their dimensions
+    dtype - type the cells are stored as
+    _partial - location of the file while it is being written
+    _offset - position of the first cell in the file
+    """
+    path: str
+    shape: Tuple[int, int, int]
+    dtype: np.dtype
+    _partial: str
+    _offset: int
+
+    def __init__(self, path: str, shape: Tuple[int, int, int], dtype: type = float) -> None:
+        """
+        Creates the file, with every cell starting out as 0
+        """
+        self.path, self.shape, self.dtype = path, shape, np.dtype(dtype)
+        # written next to the final file and moved over it once done,
+        # so that maps of a previous grid at path are left untouched
+        self._partial = path + ".part"
+        header = np.lib.format.open_memmap(self._partial, mode="w+",
+                                           dtype=self.dtype, shape=shape)
+        self._offset = header.offset
+        del header
+
+    def write_rows(self, row: int, band: np.ndarray) -> None:
+        """
+        Writes the band of every grid into the file starting at the given row
+        """
+        grid_height, grid_width = self.shape[1:]
+        with open(self._partial, "r+b") as file:
+            for grid, grid_band in enumerate(band):
+                file.seek(self._offset + (grid * grid_height + row) *
+                          grid_width * self.dtype.itemsize)
+                file.write(np.ascontiguousarray(grid_band, dtype=self.dtype).tobytes())
+
+    def load(self) -> np.memmap:
+        """
+        Maps the finished grids into memory read only,
+        cells are only read from disk when accessed
+        """
+        if os.path.exists(self._partial):
+            os.replace(self._partial, self.path)
+        return np.load(self.path, mmap_mode="r")
+
+
+def _fill_band(task: tuple) -> Tuple[int, int]:
+    """
+    Worker side of fill_grids: computes a band and writes it into the
+    grid files or the shared memory grids
+    """
+    targets, grid_shape, engine, points, radii, rows = task
+    bands = compute_windows(engine, points, radii, rows, (0, grid_shape[2]))
+    for target, band in zip(targets, bands):
+        if isinstance(target, GridFile):
+            target.write_rows(rows[0], band)
+            continue
+        shared = SharedMemory(name=target)
+        try:
+            grid = np.ndarray(grid_shape, dtype=float, buffer=shared.buf)
+            grid[:, rows[0]:rows[1]] = band
+            del grid
+        finally:
+            shared.close()
+    return rows
+
+
+def _fill_tile(task: tuple) -> List[np.ndarray]:
+    """
+    Worker side of fill_grids for sparse grids: computes a tile
+    """
+    engine, points, radii, rows, cols = task
+    return compute_windows(engine, points, radii, rows, cols)
+
+
+def fill_grid(grid: Union[np.ndarray, GridFile, SparseGrid], engine: str,
+              points: GridPoints, radius: float,
+              progress: Callable[[Iterable], Iterable] = lambda l: l,
+              index: Union[SpatialIndex, None] = None, workers: int = 1) -> None:
+    """
+    Fills the stack of grids band by band, either in memory or in a grid file
+
+    With more than one worker the bands are computed in a process pool.
+    Each worker only receives the points reaching its band and writes its
+    results straight into the grid file, or a shared memory copy of the
+    grids. The bands and their points are the same either way, so the
+    results are identical.
+
+    Sparse grids are filled tile by tile instead, only computing the
+    tiles some point reaches.
+    """
+    fill_grids([grid], engine, points, [radius], progress, index, workers)
+
+
+def fill_grids(grids: List[Union[np.ndarray, GridFile, SparseGrid]], engine: str,
+               points: GridPoints, radii: Sequence[float],
+               progress: Callable[[Iterable], Iterable] = lambda l: l,
+               index: Union[SpatialIndex, None] = None, workers: int = 1) -> None:
+    """
+    Fills a stack of grids for each radius like fill_grid, in one pass
+    over the bands so that the work shared between the radii is only done once
+    """
+    assert len(grids) == len(radii), "need one grid per radius"
+    if isinstance(grids[0], SparseGrid):
+        _fill_sparse_grids(grids, engine, points, radii, progress, index, workers)
+        return
+    grid_shape = grids[0].shape
+    grid_height, grid_width = grid_shape[1:]
+    bands = [(row, min(row + BAND_ROWS, grid_height))
+             for row in range(0, grid_height, BAND_ROWS)]
+    if workers <= 1 or len(bands) <= 1:
+        for rows in progress(bands):
+            windows = compute_windows(engine, points, radii, rows,
+                                      (0, grid_width), index)
+            for grid, band in zip(grids, windows):
+                if isinstance(grid, GridFile):
+                    grid.write_rows(rows[0], band)
+                else:
+                    grid[:, rows[0]:rows[1]] = band
+        return
+
+    # the bands are written in float64, whatever the grids are stored as
+    shared = {i: SharedMemory(create=True, size=max(int(np.prod(grid_shape)) * 8, 1))
+              for i, grid in enumerate(grids) if not isinstance(grid, GridFile)}
+    targets = [shared[i].name if i in shared else grid for i, grid in enumerate(grids)]
+
+    def tasks():
+        for rows in bands:
+            near = window_points(points.xs, points.ys, max(radii),
+                                 rows, (0, grid_width), index)
+            yield (targets, grid_shape, engine, points.subset(near), radii, rows)
+
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            for _ in progress(pool.map(_fill_band, tasks())):
+                pass
+        for i, memory in shared.items():
+            shared_grid = np.ndarray(grid_shape, dtype=float, buffer=memory.buf)
+            grids[i][:] = shared_grid
+            del shared_grid
+    finally:
+        for memory in shared.values():
+            memory.close()
+            memory.unlink()
+
+
+def _fill_sparse_grids(grids: List[SparseGrid], engine: str, points: GridPoints,
+                       radii: Sequence[float],
+                       progress: Callable[[Iterable], Iterable] = lambda l: l,
+                       index: Union[SpatialIndex, None] = None, workers: int = 1) -> None:
+    """
+    Fills sparse grids like fill_grids, a tile at a time, leaving out
+    the tiles no point reaches
+    """
+    keys = grids[0].reach_tiles(points.xs, points.ys, max(radii))
+    tiles = [grids[0].tile_bounds(key) for key in keys]
+    if workers <= 1 or len(tiles) <= 1:
+        for rows, cols in progress(tiles):
+            windows = compute_windows(engine, points, radii, rows, cols, index)
+            for grid, window in zip(grids, windows):
+                grid.set_window(rows, cols, window)
+        return
+
+    def tasks():
+        for rows, cols in tiles:
+            near = window_points(points.xs, points.ys, max(radii), rows, cols, index)
+            yield (engine, points.subset(near), radii, rows, cols)
+
+    with ProcessPoolExecutor(workers) as pool:
+        for (rows, cols), windows in zip(tiles, progress(pool.map(_fill_tile, tasks()))):
+            for grid, window in zip(grids, windows):
+                grid.set_window(rows, cols, window)
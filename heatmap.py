@@ -2,13 +2,27 @@
 Geographical heatmap module
 written by Richard Gan
 """
-from typing import List, Dict, Any, Callable, Union
-from collections import Counter as IterCounter
-from math import sqrt, ceil
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Iterable, Sequence, Union
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt, ceil, floor
 import numpy as np
-from matplotlib.colors import Colormap
-from colourmaps import get_unified_colourmap, COLOURS
-from utilities import Counter, load_from_csv, verify_dataset
+from colourmaps import COLOURS, grid_to_rgba
+from utilities import (DEFAULT_VALUE_LABEL, Dataset, dataset_from_arrays,
+                       dataset_from_rows, load_columns, verify_dataset)
+from engines import (ENGINES, GridFile, GridPoints, compute_window, fill_grids,
+                     reserve_radius)
+from spatial import SpatialIndex
+from sparse import SparseGrid
+from compact import ENCODINGS, CELL_BYTES, SPLIT_ENCODINGS, SplitGrid, empty_grid
+from adaptive import fill_adaptive
+from instrumentation import Instrumentation, NO_INSTRUMENTATION
+from planner import AUTO_ENGINE, Plan, plan_grid
+from cache import DEFAULT_CACHE_BYTES, DirectoryCache, DatasetCache, GridCache, make_key
+from render import DEFAULT_DPI, MapRender, draw_map, render_map
+from tiles import TileExporter, native_zoom
+if TYPE_CHECKING:
+    from matplotlib.colors import Colormap
 
 DEFAULT_NAME_COL = 0
 DEFAULT_LAT_COL = 1
@@ -16,45 +30,110 @@ DEFAULT_LON_COL = 2
 DEFAULT_VALUE_COL = 3
 DEFAULT_SCALE = 0.007
 DEFAULT_RADIUS = 0.2
-FIGSIZE = (16, 10)
+# grids bigger than this are thinned out before being displayed
+MAX_DISPLAY_CELLS = 4096 * 4096
 MODES = ["influence", "weighted"]
 LEGEND_LOCATIONS = ["best", "upper right", "upper left", "lower left", 
                     "lower right", "right", "center left", "center right", 
                     "lower center", "upper center", "center"]
 
+def _progress_bar() -> Callable[[Iterable], Iterable]:
+    """
+    Returns a progress bar to wrap iterables in, displaying progress nicely
+    if progressbar is installed, passing them through otherwise
+    """
+    try:
+        import progressbar
+    except ImportError:
+        return lambda l: l
+    return progressbar.ProgressBar()
+
 class Heatmap:
     """
     Defines a heatmap
 
-    grid - grid of the heatmap
+    grid - grid of the heatmap, memory mapped from grid_file if it is set, a
+           SparseGrid if sparse is or a SplitGrid if encoding is split, one
+           grid per value column stacked if value_col is a list
+    _verbose - whether debugging information is printed
     _verboseprint - function for debugging purposes
-    _filepath - current source dataset
+    _filepath - current source dataset, None for points given in memory
+    _source - dataset of the points given in memory instead of a csv file
     _mode - data parsing mode for the map
     name_col - column to pull names from
     lat_col - column to pull lats from
     lon_col - column to pull lons from
-    value_col - column to pull values from
+    value_col - column to pull values from, or a list of them to generate
+                a grid for each while computing the distances only once,
+                the grids all covering the points of every value column
     scale - scale of the map
     radius - search radius for grid generation (in degrees)
     border_offset - area of blank space around the map (in degrees)
-    _values - values of points being plotted
+    engine - algorithm used to fill in the grid, or AUTO_ENGINE for the one
+             the planner predicts to be the fastest
+    workers - amount of processes filling in the grid and writing swept maps
+    grid_file - .npy file to write the grid to instead of keeping it in memory
+    cache_dir - directory to cache loaded datasets and grids in, no caching if None
+    cache_bytes - size each cache of cache_dir is trimmed down to
+    sparse - whether grids only store the tiles some point reaches, their dense
+             arrays being built when they are displayed
+    adaptive_tolerance - tolerance of adaptive refinement, which fills in blocks
+                         of cells from their corners when these agree, every
+                         cell is evaluated if None or when the plan predicts
+                         that to be cheaper
+    evaluated_fraction - fraction of the cells of the last grids filled in
+                         that were evaluated
+    instrumentation - receives the timings of the phases of generating the heatmap
+    max_seconds - predicted time over which grids are refused, no limit if None
+    max_bytes - predicted memory over which grids are refused, no limit if None
+    plan - plan of the last grids filled in, None before any
+    encoding - how the cells of the grids are stored, one of ENCODINGS:
+               float32 halves their size, uint8 and uint16 split influence
+               grids into a legend number and a quantized fade
+    _all_names - names of the points loaded, one point per csv row
+    _all_lats - latitudes of the points loaded
+    _all_lons - longitudes of the points loaded
+    _load_key - file and columns the points were loaded from, to skip reloading them
+    _datasets - entries of each value column, including changes made to the points
+    _rows - csv row of each point, points added later get rows past the end
+    _kept - index of each point being plotted among the points loaded
     _lats - latitudes of points being plotted
     _lons - longitudes of points being plotted
     _names - names of points being plotted
-    _legend - value to number mapping for the points
+    _labels - label of each value column
+    _legends - value to number mapping for the points, per value column
     _lat_min - smallest lat subtracted by border_width
     _lat_max - biggest lat added by border_width
     _lon_min - smallest lon subtracted by border_width
     _lon_max - biggest lon added by border_width
+    _payload - per point count of each value, or sum of the values in weighted mode
+    _order - first entry of each value of each point, breaking ties between values
+    _legend_values - legend number of each payload column
+    _groups - value column of each payload column
+    _entries - point, payload column and rank of every value read in (influence mode)
+    _sites - site of each point being plotted, points at the same coordinates
+             sharing one site
+    _points - grid coordinates and payload of the sites handed to the grid engines,
+              the payload of a site adding up that of its points
+    _grids - grid of each value column stacked
+    _grid_state - what the grids were computed with, None if they can't be updated
+    _dirty - windows of cells to recompute because points changed, None if
+             the grids can't be updated
+    _index - spatial index over the grid coordinates of the points
+    _index_state - scale and radius the points were placed and indexed with
+    _fingerprint - cache key of the loaded dataset, None if not caching
+    _caches - caches in use, by their directory
     """
     grid: np.ndarray
+    _verbose: bool
     _verboseprint: Callable[..., Union[str, None]]
-    _filepath: str
+    _filepath: Union[str, None]
+    _source: Union[Dataset, None]
     _mode: str
     name_col: int
     lat_col: int
     lon_col: int
-    value_col: int
+    value_col: Union[int, List[int]]
     scale: float
     radius: float
     border_offset: float
@@ -62,33 +141,132 @@ class Heatmap:
     south_offset: float
     east_offset: float
     west_offset: float
-    _values: List[str]
-    _lats: List[float]
-    _lons: List[float]
-    _names: List[str]
-    _legend: Dict[str, int]
+    engine: str
+    workers: int
+    grid_file: Union[str, None]
+    cache_dir: Union[str, None]
+    cache_bytes: int
+    sparse: bool
+    adaptive_tolerance: Union[float, None]
+    evaluated_fraction: float
+    instrumentation: Instrumentation
+    max_seconds: Union[float, None]
+    max_bytes: Union[int, None]
+    plan: Union[Plan, None]
+    encoding: str
+    _all_names: np.ndarray
+    _all_lats: np.ndarray
+    _all_lons: np.ndarray
+    _load_key: Union[tuple, None]
+    _datasets: List[Dataset]
+    _rows: np.ndarray
+    _kept: np.ndarray
+    _lats: np.ndarray
+    _lons: np.ndarray
+    _names: np.ndarray
+    _labels: List[str]
+    _legends: List[Dict[str, int]]
     _lat_min: float
     _lat_max: float
     _lon_min: float
     _lon_max: float
+    _payload: np.ndarray
+    _order: Union[np.ndarray, None]
+    _legend_values: np.ndarray
+    _groups: np.ndarray
+    _entries: Union[np.ndarray, None]
+    _sites: np.ndarray
+    _points: GridPoints
+    _grids: Union[np.ndarray, SparseGrid, SplitGrid]
+    _grid_state: Union[tuple, None]
+    _dirty: Union[List[tuple], None]
+    _index: SpatialIndex
+    _index_state: tuple
+    _fingerprint: Union[str, None]
+    _caches: Dict[str, DirectoryCache]
 
     def __init__(self, filepath: str, mode: str = MODES[0],
                  name_col: int = DEFAULT_NAME_COL, lat_col: int = DEFAULT_LAT_COL,
-                 lon_col: int = DEFAULT_LON_COL, value_col: int = DEFAULT_VALUE_COL,
+                 lon_col: int = DEFAULT_LON_COL,
+                 value_col: Union[int, List[int]] = DEFAULT_VALUE_COL,
                  scale: float = DEFAULT_SCALE, radius: float = DEFAULT_RADIUS,
                  border_offset: float = 0, north_offset: float = 0,
                  south_offset: float = 0, east_offset: float = 0,
-                 west_offset: float = 0, verbose: bool = False) -> None:
+                 west_offset: float = 0, verbose: bool = False,
+                 engine: str = ENGINES[0], workers: int = 1,
+                 grid_file: Union[str, None] = None,
+                 cache_dir: Union[str, None] = None, sparse: bool = False,
+                 adaptive_tolerance: Union[float, None] = None,
+                 instrumentation: Instrumentation = NO_INSTRUMENTATION,
+                 max_seconds: Union[float, None] = None,
+                 max_bytes: Union[int, None] = None,
+                 encoding: str = ENCODINGS[0],
+                 cache_bytes: int = DEFAULT_CACHE_BYTES) -> None:
         """
         Initializes a new heatmap
         """
+        assert engine in ENGINES + [AUTO_ENGINE], "invalid engine"
+        assert workers >= 1, "invalid amount of workers"
+        assert not (sparse and grid_file), "sparse grids can't be written to a grid file"
+        assert adaptive_tolerance == None or adaptive_tolerance >= 0, "invalid tolerance"
+        assert encoding in ENCODINGS, "invalid encoding"
+        assert not (sparse and encoding != ENCODINGS[0]), "sparse grids are stored as float64"
+        assert not (grid_file and encoding in SPLIT_ENCODINGS), \
+            "split grids can't be written to a grid file"
         self._filepath, self._mode, self.name_col = filepath, mode, name_col
+        self._source = None
         self.lat_col, self.lon_col, self.value_col = lat_col, lon_col, value_col
         self.scale, self.radius, self.border_offset = scale, radius, border_offset
         self.north_offset, self.south_offset = north_offset, south_offset
         self.east_offset, self.west_offset = east_offset, west_offset
+        self.engine, self.workers = engine, workers
+        self.grid_file, self.cache_dir, self.sparse = grid_file, cache_dir, sparse
+        self.adaptive_tolerance, self.evaluated_fraction = adaptive_tolerance, 1.0
+        self.instrumentation = instrumentation
+        self.max_seconds, self.max_bytes, self.plan = max_seconds, max_bytes, None
+        self.encoding, self.cache_bytes = encoding, cache_bytes
+        self._fingerprint, self._caches, self._load_key = None, {}, None
+        self._grid_state, self._dirty = None, None
+        self._verbose = verbose
         self._verboseprint = print if verbose else lambda *a, **k: None
 
+    @classmethod
+    def from_arrays(cls, lats: object, lons: object, values: object,
+                    names: Union[object, None] = None, mode: str = MODES[0],
+                    categories: Union[List[str], None] = None,
+                    value_label: str = DEFAULT_VALUE_LABEL, **kwargs) -> "Heatmap":
+        """
+        Returns a heatmap of points held in arrays, or any objects supporting
+        the buffer protocol, instead of a csv file, which are used without
+        being copied when they hold floats (and integer codes into categories
+        in influence mode)
+        kwargs are the arguments of the constructor after the columns
+        """
+        return cls._from_dataset(dataset_from_arrays(lats, lons, values, names, mode,
+                                                     categories, value_label),
+                                 mode, kwargs)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[object]], mode: str = MODES[0],
+                  value_label: str = DEFAULT_VALUE_LABEL, **kwargs) -> "Heatmap":
+        """
+        Returns a heatmap of the name, lat, lon, value rows of any iterable,
+        like a stream of records, read the way csv rows are
+        kwargs are the arguments of the constructor after the columns
+        """
+        return cls._from_dataset(dataset_from_rows(rows, value_label, mode), mode, kwargs)
+
+    @classmethod
+    def _from_dataset(cls, dataset: Dataset, mode: str, kwargs: Dict[str, Any]) -> "Heatmap":
+        """
+        Returns a heatmap of a dataset built in memory
+        """
+        assert mode in MODES, "invalid mode"
+        assert len(dataset), "no points given"
+        heatmap = cls(None, mode, value_col=0, **kwargs)
+        heatmap._source = dataset
+        return heatmap
+
     @property
     def filepath(self) -> str:
         """
@@ -99,7 +277,7 @@ class Heatmap:
     @filepath.setter
     def filepath(self, value: str) -> None:
         verify_dataset(value)
-        self._filepath = value
+        self._filepath, self._source = value, None
 
     @property
     def mode(self) -> str:
@@ -112,56 +290,509 @@ class Heatmap:
     def mode(self, value: str) -> None:
         value = value.lower()
         assert value in MODES
+        assert self._source == None or value == self._mode, \
+            "the mode of points given in memory can't be changed"
         self._mode = value
 
     def change_dataset(self, filepath: str,
                        name_col: int = 0, lat_col: int = 1,
-                       lon_col: int = 2, value_col: int = 3):
+                       lon_col: int = 2, value_col: Union[int, List[int]] = 3):
         """
         Set a different dataset to be read
         """
-        verify_dataset(self._filepath)
-        self._filepath, self.name_col = filepath, name_col
+        verify_dataset(filepath)
+        self._filepath, self._source, self.name_col = filepath, None, name_col
         self.lat_col, self.lon_col, self.value_col = lat_col, lon_col, value_col
 
     
+    def _value_cols(self) -> List[int]:
+        """
+        Returns the value columns to generate grids for
+        """
+        return [self.value_col] if isinstance(self.value_col, int) else list(self.value_col)
+
+    def _load_dataset(self, value_col: int) -> tuple:
+        """
+        Loads the columns of the dataset for a value column, memory mapping
+        them from the cache when the same file was loaded the same way before
+        Returns the columns and their cache key, None if not caching
+        """
+        if not self.cache_dir:
+            return load_columns(self._filepath, self.name_col, self.lat_col,
+                                self.lon_col, value_col, self._mode), None
+        cache = self._cache(DatasetCache, "datasets")
+        key = cache.dataset_key(self._filepath, self.name_col, self.lat_col,
+                                self.lon_col, value_col, self._mode)
+        data = cache.load(self._filepath, self.name_col, self.lat_col,
+                          self.lon_col, value_col, self._mode, key)
+        self._report_cache("Dataset", cache)
+        return data, key
+
+    def _cache(self, kind: type, name: str) -> DirectoryCache:
+        """
+        Returns the cache of the given kind kept in the name subdirectory
+        of cache_dir, reusing it across calls so its statistics add up
+        """
+        root = os.path.join(self.cache_dir, name)
+        if root not in self._caches:
+            self._caches[root] = kind(root, self.cache_bytes)
+        return self._caches[root]
+
+    def _report_cache(self, label: str, cache: DirectoryCache) -> None:
+        """
+        Prints the statistics of a cache
+        """
+        self._verboseprint("{} cache: {} hit(s), {} miss(es), {} bytes stored".format(
+                           label, cache.hits, cache.misses, cache.bytes_stored))
+
     def _initialize_data(self) -> None:
         """
-        Loads the dataset and prepares for it to be generated
+        Loads the dataset unless it is loaded already and prepares
+        for it to be generated
         """
-        data = load_from_csv(self._filepath, self.name_col, self.lat_col,
-                             self.lon_col, self.value_col)
-        value_label = data.pop()
-        self._names, self._lats, self._lons, self._values = data
+        with self.instrumentation.phase("initialize_data"):
+            self._load_data()
+            self._lat_max = self._all_lats.max() + self.border_offset + self.north_offset
+            self._lat_min = self._all_lats.min() - self.border_offset - self.south_offset
+            self._lon_max = self._all_lons.max() + self.border_offset + self.east_offset
+            self._lon_min = self._all_lons.min() - self.border_offset - self.west_offset
 
-        self._lat_max = max(self._lats) + self.border_offset + self.north_offset
-        self._lat_min = min(self._lats) - self.border_offset - self.south_offset
-        self._lon_max = max(self._lons) + self.border_offset + self.east_offset
-        self._lon_min = min(self._lons) - self.border_offset - self.west_offset
+            with self.instrumentation.phase("place_points") as phase:
+                self._place_points()
+                phase["points"], phase["sites"] = len(self._sites), len(self._points.xs)
 
+    def _load_data(self) -> None:
+        """
+        Loads the value columns of the dataset, skipped if they were
+        already loaded from the same, unchanged, file
+        Points given in memory are only loaded once
+        """
+        if self._source != None:
+            load_key = (id(self._source), self._mode)
+        else:
+            stat = os.stat(self._filepath)
+            load_key = (self._filepath, stat.st_mtime_ns, stat.st_size, self.name_col,
+                        self.lat_col, self.lon_col, tuple(self._value_cols()), self._mode)
+        if load_key == self._load_key:
+            return
+        with self.instrumentation.phase("load_csv",
+                                        columns=len(self._value_cols())) as phase:
+            loaded = ([(self._source, None)] if self._source != None else
+                      [self._load_dataset(value_col) for value_col in self._value_cols()])
+            phase["entries"] = sum(len(data.names) for data, _ in loaded)
+        self._datasets = [data for data, _ in loaded]
+        keys = [key for _, key in loaded]
+        self._fingerprint = (None if None in keys else
+                             keys[0] if len(keys) == 1 else make_key(*keys))
+        self._labels = [data.value_label for data in self._datasets]
+        self._prepare_data()
+        self._load_key = load_key
+        self._grid_state, self._dirty = None, None
+
+    def _prepare_data(self) -> None:
+        """
+        Builds the legends and the points of the loaded value columns
+        """
         # assigning a number to each unique value provided, and map it to the points
-        count = IterCounter(self._values)
-        # value[0] because value from a enumerate(IterCounter) gives a 
-        # tuple of the name of the item and how many of that item 
-        # are contained within the count.
-        if self._mode == MODES[0]:
-            self._legend = {value[0]: i + 1 if i + 1 <= len(COLOURS) else len(COLOURS)
-                            for i, value in enumerate(count.most_common())}
-            self._verboseprint(self._legend)
-
-        elif self._mode == MODES[1]:
-            self._legend = {value_label: 1}
-            self._values = [float(v) for v in self._values]
+        self._legends, codes = [], []
+        for data in self._datasets:
+            if self._mode == MODES[0]:
+                # most common values first, ties in order of first appearance
+                count = np.bincount(data.values, minlength=len(data.categories))
+                order = np.argsort(-count, kind="stable")
+                legend = {data.categories[value]: i + 1 if i + 1 <= len(COLOURS)
+                          else len(COLOURS) for i, value in enumerate(order)}
+                self._verboseprint(legend)
+                # recode the values so that they follow the legend
+                rank = np.empty(len(order), dtype=data.values.dtype)
+                rank[order] = np.arange(len(order))
+                codes.append(rank[data.values])
 
-    
-    def calculate_grid(self) -> None:
+            elif self._mode == MODES[1]:
+                legend = {data.value_label: 1}
+                codes.append(np.zeros(len(data), dtype=np.int32))
+            self._legends.append(legend)
+
+        self._merge_rows(self._datasets, codes)
+
+    def _merge_rows(self, datasets: List[Dataset], codes: List[np.ndarray]) -> None:
+        """
+        Turns the entries of every value column into one point per csv row,
+        with a payload column per legend entry of each value column, so
+        that the distances of each row are only computed once
+        """
+        if len(datasets) == 1 and (np.diff(datasets[0].rows) > 0).all():
+            # every row holds one entry, so the columns, which may be memory
+            # mapped from the cache, are used as they are instead of copied
+            data = datasets[0]
+            rows, self._all_names = data.rows, data.names
+            self._all_lats, self._all_lons = data.lats, data.lons
+        else:
+            all_rows = np.concatenate([data.rows for data in datasets])
+            rows, first = np.unique(all_rows, return_index=True)
+            self._all_names = np.concatenate([data.names for data in datasets])[first]
+            self._all_lats = np.concatenate([data.lats for data in datasets])[first]
+            self._all_lons = np.concatenate([data.lons for data in datasets])[first]
+        self._rows = rows
+
+        payload, order, legend_values, groups, entries = [], [], [], [], []
+        for group, (data, values, legend) in enumerate(zip(datasets, codes,
+                                                           self._legends)):
+            points = np.searchsorted(rows, data.rows)
+            columns = np.zeros((len(rows), len(legend)))
+            if self._mode == MODES[0]:
+                np.add.at(columns, (points, values), 1.0)
+            elif self._mode == MODES[1]:
+                np.add.at(columns, (points, values), data.values)
+            # the earliest entry of each value of a row breaks ties
+            # between values, as it would have without merging
+            ranks = np.full(columns.shape, np.iinfo(np.int64).max)
+            np.minimum.at(ranks, (points, values), np.arange(len(data)))
+            entries.append(np.column_stack([points, len(legend_values) + values,
+                                            np.arange(len(data))]))
+            payload.append(columns)
+            order.append(ranks)
+            legend_values.extend(legend.values())
+            groups.extend([group] * len(legend))
+        self._payload = np.hstack(payload)
+        self._order = np.hstack(order) if self._mode == MODES[0] else None
+        self._entries = (np.vstack(entries).astype(np.int64)
+                         if self._mode == MODES[0] else None)
+        self._legend_values = np.array(legend_values)
+        self._groups = np.array(groups)
+
+    def _place_points(self) -> None:
+        """
+        Determines the grid coordinates of the points, drops the points
+        too far out of the map to matter and indexes the rest
+        Points at the same coordinates are the same distance from every
+        cell, so they are merged into one site before being handed to the
+        engines, which then compute each distance only once
+        """
+        self._verboseprint("Determining grid coordinates of points...")
+        keep = ((self._all_lons >= self._lon_min - self.radius) &
+                (self._all_lons <= self._lon_max + self.radius) &
+                (self._all_lats >= self._lat_min - self.radius) &
+                (self._all_lats <= self._lat_max + self.radius))
+        self._kept = np.flatnonzero(keep)
+        self._names, self._lats, self._lons = (self._all_names[keep],
+                                               self._all_lats[keep],
+                                               self._all_lons[keep])
+        _, first, sites = np.unique(np.stack([self._lats, self._lons], axis=1), axis=0,
+                                    return_index=True, return_inverse=True)
+        # sites are ordered by their first point, like the points are
+        by_first = np.argsort(first)
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[by_first] = np.arange(len(first))
+        self._sites, first = rank[sites.ravel()], first[by_first]
+        payload = np.zeros((len(first), self._payload.shape[1]))
+        np.add.at(payload, self._sites, self._payload[keep])
+        order = None
+        if self._order is not None:
+            # the earliest entry of each value at a site still breaks ties
+            order = np.full(payload.shape, np.iinfo(np.int64).max)
+            np.minimum.at(order, self._sites, self._order[keep])
+        entries = None
+        if self._entries is not None:
+            site = np.full(len(self._all_lats), -1)
+            site[self._kept] = self._sites
+            entries = self._entries[site[self._entries[:, 0]] >= 0]
+            entries[:, 0] = site[entries[:, 0]]
+        self._points = GridPoints(
+            self._mode,
+            np.ceil((self._lons[first] - self._lon_min) / self.scale).astype(np.int64),
+            np.ceil((self._lats[first] - self._lat_min) / self.scale).astype(np.int64),
+            payload, self._legend_values, self._groups, order, entries)
+        self._verboseprint("{} point(s) at {} distinct coordinates".format(
+                           len(self._sites), len(first)))
+
+        if self._verbose:
+            # names of the payload columns, prefixed by their value column
+            # when there is more than one of them
+            columns = ["{}: {}".format(label, value) if len(self._labels) > 1 else value
+                       for label, legend in zip(self._labels, self._legends)
+                       for value in legend]
+            for i, (name, lat, lon) in enumerate(zip(self._names, self._lats, self._lons)):
+                row, site = self._payload[self._kept[i]], self._sites[i]
+                if self._mode == MODES[0]:
+                    value_text = ", ".join("{} x{}".format(columns[value], int(row[value]))
+                                           for value in np.flatnonzero(row))
+                elif self._mode == MODES[1]:
+                    value_text = ", ".join("{} {}".format(column, value)
+                                           for column, value in zip(columns, row))
+                # y comes first in the way the grid displays the map
+                # which is why it is reversed in this fashion.
+                # debugging is shown in x y to keep in line with
+                # conventional thinking, since if you think of them
+                # in the x y convention then it still makes sense 
+                # on the actual map.
+                self._verboseprint(("{} -> Map Coords: ({}, {}) || "
+                                    "Grid Coords: ({}, {}) || "
+                                    "Value: {}").format(
+                                    name, lat, lon, self._points.xs[site],
+                                    self._points.ys[site], value_text))
+
+        # buckets span the search radius so that a radius query
+        # only ever has to look at the neighbouring buckets
+        self._index = SpatialIndex(self._points.xs, self._points.ys,
+                                   max(self.radius / self.scale, 1))
+        self._index_state = (self.scale, self.radius)
+
+    def points_within(self, lat: float, lon: float,
+                      radius: Union[float, None] = None) -> np.ndarray:
+        """
+        Returns the indices of the points within radius (in degrees,
+        defaults to the search radius) of (lat, lon), in dataset order
+        These are the indices modify_point and remove_point take
+        Loads the dataset first if it has not been loaded yet, and places
+        the points again if the scale or radius changed since
+        """
+        if (getattr(self, "_index", None) == None
+                or self._index_state != (self.scale, self.radius)):
+            self._initialize_data()
+        radius = self.radius if radius == None else radius
+        # points sit on the grid cell their coordinates are rounded up to,
+        # so the lookup is widened by a cell before checking exact distances
+        sites = self._index.query_radius((lon - self._lon_min) / self.scale,
+                                         (lat - self._lat_min) / self.scale,
+                                         radius / self.scale + sqrt(2))
+        found = np.flatnonzero(np.isin(self._sites, sites))
+        lats, lons = self._lats[found], self._lons[found]
+        return self._kept[found[(lats - lat) ** 2 + (lons - lon) ** 2 <= radius ** 2]]
+
+    def add_point(self, name: str, lat: float, lon: float,
+                  value: Union[str, float, list]) -> int:
+        """
+        Adds a point after the points of the dataset, returns its index
+        value is given like it would be in the csv file, or as a list of
+        such values with one per value column when value_col is a list,
+        None leaving the point out of that value column
+        Only the cells around the point are recomputed by the next
+        calculate_grid, unless the extent or a legend changes
+        """
+        self._load_data()
+        row = int(self._rows.max()) + 1 if len(self._rows) else 0
+        self._replace_row(row, (name, lat, lon, self._parse_values(value)))
+        return int(np.searchsorted(self._rows, row))
+
+    def remove_point(self, index: int) -> None:
+        """
+        Removes the point at index, see add_point
+        """
+        self._load_data()
+        self._replace_row(int(self._rows[index]), None)
+
+    def modify_point(self, index: int, name: Union[str, None] = None,
+                     lat: Union[float, None] = None, lon: Union[float, None] = None,
+                     value: Union[str, float, list, None] = None) -> None:
+        """
+        Changes the given fields of the point at index, see add_point
+        """
+        self._load_data()
+        row = int(self._rows[index])
+        name = self._all_names[index] if name == None else name
+        lat = self._all_lats[index] if lat == None else lat
+        lon = self._all_lons[index] if lon == None else lon
+        if value == None:
+            # the values the point has now, in the order they were entered
+            values = []
+            for data in self._datasets:
+                entries = data.values[data.rows == row]
+                values.append([data.categories[code] for code in entries]
+                              if self._mode == MODES[0] else entries.tolist())
+        else:
+            values = self._parse_values(value)
+        self._replace_row(row, (name, lat, lon, values))
+
+    def _parse_values(self, value: Union[str, float, list]) -> List[list]:
+        """
+        Splits the values of a point given to add_point into the
+        entries of each value column
+        """
+        values = [value] if isinstance(self.value_col, int) else list(value)
+        assert len(values) == len(self._datasets), "need one value per value column"
+        entries = []
+        for value in values:
+            if value == None:
+                entries.append([])
+                continue
+            split = str(value).strip().split("/")
+            assert all(split), "invalid value"
+            entries.append(split if self._mode == MODES[0]
+                           else [float(entry) for entry in split])
+        return entries
+
+    def _replace_row(self, row: int, point: Union[tuple, None]) -> None:
+        """
+        Replaces the entries of a csv row in every value column by those
+        of point, a name, lat, lon and entries per value column, or
+        removes them if point is None
+        The cells around the old and new location become dirty, and the
+        legends and points are rebuilt the way a load of the changed file
+        would build them
+        """
+        index = np.searchsorted(self._rows, row)
+        if index < len(self._rows) and self._rows[index] == row:
+            self._mark_dirty(self._all_lats[index], self._all_lons[index])
+        if point != None:
+            self._mark_dirty(point[1], point[2])
+
+        datasets = []
+        for group, data in enumerate(self._datasets):
+            keep = data.rows != row
+            entries = [] if point == None else point[3][group]
+            # the entries go where the row would be in the file
+            at = int(np.searchsorted(data.rows[keep], row))
+            categories = list(data.categories)
+            if self._mode == MODES[0]:
+                for entry in entries:
+                    if entry not in categories:
+                        categories.append(entry)
+                new_values = np.array([categories.index(entry) for entry in entries],
+                                      dtype=data.values.dtype)
+            else:
+                new_values = np.array(entries, dtype=data.values.dtype)
+
+            def insert(column, new):
+                column = column[keep]
+                return np.concatenate([column[:at], np.asarray(new), column[at:]])
+
+            count = len(entries)
+            values = insert(data.values, new_values)
+            if self._mode == MODES[0] and len(values):
+                # categories are numbered in order of first appearance,
+                # dropping the ones no entry has any more
+                used, first = np.unique(values, return_index=True)
+                used = used[np.argsort(first)]
+                recode = np.zeros(len(categories), dtype=values.dtype)
+                recode[used] = np.arange(len(used))
+                values, categories = recode[values], [categories[c] for c in used]
+            datasets.append(Dataset(
+                insert(data.names, np.array([point[0]] * count if count else [], dtype=str)),
+                insert(data.lats, np.full(count, point[1] if count else 0.0)),
+                insert(data.lons, np.full(count, point[2] if count else 0.0)),
+                values, insert(data.rows, np.full(count, row, dtype=np.int64)),
+                categories, data.value_label))
+        assert sum(len(data) for data in datasets), "cannot remove every point"
+
+        self._datasets = datasets
+        self._prepare_data()
+        # the file no longer describes the points
+        self._fingerprint, self._index = None, None
+
+    def _mark_dirty(self, lat: float, lon: float) -> None:
+        """
+        Marks the cells within the search radius of a location as needing
+        to be recomputed by the next calculate_grid
+        """
+        if self._dirty == None:
+            return
+        reach = floor(self.radius / self.scale)
+        x = ceil((lon - self._lon_min) / self.scale)
+        y = ceil((lat - self._lat_min) / self.scale)
+        grid_height, grid_width = self._grids.shape[1:]
+        rows = (max(y - reach, 0), min(y + reach + 1, grid_height))
+        cols = (max(x - reach, 0), min(x + reach + 1, grid_width))
+        if rows[0] < rows[1] and cols[0] < cols[1]:
+            self._dirty.append((rows, cols))
+
+    def calculate_grid(self, engine: Union[str, None] = None) -> None:
         """
         Calculates the values of the grid based on current information
+        engine overrides the engine set on the heatmap for this calculation
         """
+        engine = self.engine if engine == None else engine
+        assert engine in ENGINES + [AUTO_ENGINE], "invalid engine"
         self._verboseprint("Reading data...")
 
         self._initialize_data()
+        if engine == AUTO_ENGINE:
+            engine = self._plan([self.radius], engine, self.grid_file).engine
+        grid_state = self._grid_key(engine)
+        if grid_state == self._grid_state:
+            # only the cells around changed points need to be recomputed
+            self._update_grid(engine)
+            return
+        self._set_grid(self._compute_grids([self.radius], engine, self.grid_file)[0],
+                       grid_state)
+
+    def plan_grid(self, engine: Union[str, None] = None) -> Plan:
+        """
+        Returns the predicted time and memory of calculating the grid, along
+        with the engine and amount of workers it would be calculated with
+        Loads the dataset first if it has not been loaded yet
+        """
+        engine = self.engine if engine == None else engine
+        assert engine in ENGINES + [AUTO_ENGINE], "invalid engine"
+        self._initialize_data()
+        return self._plan([self.radius], engine, self.grid_file)
+
+    def _plan(self, radii: List[float], engine: str,
+              grid_file: Union[str, None] = None) -> Plan:
+        """
+        Returns the plan of filling in the grids of the loaded data for
+        each radius, with the cheapest engine if engine is AUTO_ENGINE
+        """
+        storage = ("file" if grid_file and len(radii) == 1 else
+                   "sparse" if self.sparse else "memory")
+        return plan_grid(self._mode, len(self._points.xs), self._points.payload.shape[1],
+                         ceil((self._lat_max - self._lat_min) / self.scale),
+                         ceil((self._lon_max - self._lon_min) / self.scale),
+                         max(radii) / self.scale, self._points.grids, len(radii), storage,
+                         ENGINES if engine == AUTO_ENGINE else [engine], self.workers,
+                         CELL_BYTES[self.encoding], self.adaptive_tolerance != None)
+
+    def _grid_key(self, engine: str) -> tuple:
+        """
+        Returns everything the cells of the grid depend on besides the points
+        """
+        return (engine, self._mode, self.scale, self.radius, self.grid_file,
+                self.sparse, self.adaptive_tolerance, self.encoding,
+                self._lat_min, self._lat_max, self._lon_min, self._lon_max,
+                tuple(self._value_cols()),
+                [list(legend.items()) for legend in self._legends])
+
+    def _update_grid(self, engine: str) -> None:
+        """
+        Recomputes the dirty cells of the grid
+        """
+        if not self._dirty:
+            return
+        self._verboseprint("Recomputing {} changed window(s)...".format(len(self._dirty)))
+        grids = self._grids
+        if isinstance(grids, SparseGrid):
+            # tiles taken from the grid cache are copied as they are updated
+            for rows, cols in self._dirty:
+                grids.set_window(rows, cols, compute_window(
+                    engine, self._points, self.radius / self.scale, rows, cols, self._index))
+            self._set_grid(grids, self._grid_state)
+            return
+        if isinstance(grids, SplitGrid):
+            # planes mapped from the grid cache are copied as they are updated
+            grids = grids if grids.categories.flags.writeable else grids.copy()
+        elif not grids.flags.writeable:
+            # grid files are updated in place, cached grids are left alone
+            if (self.grid_file and isinstance(grids, np.memmap) and
+                os.path.samefile(grids.filename, self.grid_file)):
+                grids = np.load(self.grid_file, mmap_mode="r+")
+            else:
+                grids = np.array(grids)
+        for rows, cols in self._dirty:
+            grids[:, rows[0]:rows[1], cols[0]:cols[1]] = compute_window(
+                engine, self._points, self.radius / self.scale, rows, cols, self._index)
+        self._set_grid(grids, self._grid_state)
+
+    def _compute_grids(self, radii: List[float], engine: str,
+                       grid_file: Union[str, None] = None) -> List[np.ndarray]:
+        """
+        Computes the stack of grids of the loaded data for each radius,
+        taking the ones cached from an earlier run from the grid cache
+        and filling in the others in one pass
+        grid_file is used to write the grids to when there is only one radius
+        """
         self._verboseprint("Initializing map grid generation...")
+        assert self.encoding not in SPLIT_ENCODINGS or self._mode == MODES[0], \
+            "only influence grids can be split"
         # initial grid
         grid_width = ceil((self._lon_max - self._lon_min) / self.scale)
         grid_height = ceil((self._lat_max - self._lat_min) / self.scale)
@@ -178,126 +809,271 @@ class Heatmap:
                             self._lon_min, self._lon_max, grid_width,
                             grid_width, grid_height))
 
-        grid = np.full((grid_height, grid_width), 0.0)
+        grids = [None] * len(radii)
+        grid_cache = self._cache(GridCache, "grids") if self._fingerprint else None
+        if grid_cache:
+            grid_keys = [grid_cache.grid_key(self._fingerprint, self._mode, self.scale,
+                                             radius, self.border_offset,
+                                             self.north_offset, self.south_offset,
+                                             self.east_offset, self.west_offset,
+                                             self.adaptive_tolerance, self.encoding,
+                                             self.sparse)
+                         for radius in radii]
+            grids = [grid_cache.load_grid(grid_key) for grid_key in grid_keys]
+            self._report_cache("Grid", grid_cache)
+        missing = [i for i, grid in enumerate(grids) if grid is None]
+        if not missing:
+            return grids
 
-        self._verboseprint("Determining grid coordinates of points...")
-        x_coords, y_coords, remove = [], [], []
-        item_count = len(self._names)
-        for i in range(item_count):
-            lat, lon = self._lats[i], self._lons[i]
-            value, name = self._values[i], self._names[i]
-            if (lon < self._lon_min - self.radius or
-                lon > self._lon_max + self.radius or
-                lat < self._lat_min - self.radius or
-                lat > self._lat_max + self.radius):
-                remove.append(i)
-                continue
-            grid_x = ceil((lon - self._lon_min) / self.scale)
-            grid_y = ceil((lat - self._lat_min) / self.scale)
-            x_coords.append(grid_x)
-            y_coords.append(grid_y)
-            # y comes first in the way the grid displays the map
-            # which is why it is reversed in this fashion.
-            # debugging is shown in x y to keep in line with
-            # conventional thinking, since if you think of them
-            # in the x y convention then it still makes sense 
-            # on the actual map.
-            value_text = ("{} ({})".format(value, self._legend[value])
-                          if self._mode == MODES[0] else value)
-            self._verboseprint(("{} -> Map Coords: ({}, {}) || "
-                                "Grid Coords: ({}, {}) || "
-                                "Value: {}").format(
-                                name, lat, lon, grid_x, grid_y, value_text))
-        remove.sort(reverse=True)
-        for i in remove:
-            self._lats.pop(i)
-            self._lons.pop(i)
-            self._values.pop(i)
-            self._names.pop(i)
-        self._verboseprint("Filling in the grid...")
+        self.plan = self._plan([radii[i] for i in missing], engine, grid_file)
+        self._verboseprint("Plan: {}".format(self.plan.summary()))
+        self.plan.check(self.max_seconds, self.max_bytes)
+        engine, workers = self.plan.engine, self.plan.workers
+
+        grid_shape = (self._points.grids, grid_height, grid_width)
+        if grid_file and len(radii) == 1:
+            # bounds memory use to a band of rows no matter how big the map is
+            self._verboseprint("Writing the grid to {}...".format(grid_file))
+            targets = [GridFile(grid_file, grid_shape, self.encoding)]
+        elif self.sparse:
+            targets = [SparseGrid(grid_shape) for _ in missing]
+        else:
+            targets = [empty_grid(grid_shape, self.encoding) for _ in missing]
+
+        self._verboseprint("Filling in the grid using the {} engine "
+                           "with {} worker(s)...".format(engine, workers))
+        prog_bar = _progress_bar()
+        with self.instrumentation.phase("grid_fill", engine=engine, workers=workers,
+                                        grids=len(missing) * grid_shape[0],
+                                        rows=grid_height, cols=grid_width) as phase:
+            if self.adaptive_tolerance == None or not self.plan.adaptive:
+                if self.adaptive_tolerance != None:
+                    self._verboseprint("Filling in every cell, predicted to be cheaper "
+                                       "than adaptive refinement")
+                fill_grids(targets, engine, self._points,
+                           [radii[i] / self.scale for i in missing],
+                           prog_bar, self._index, workers)
+                evaluated = len(missing) * grid_height * grid_width
+                self.evaluated_fraction = 1.0
+            else:
+                evaluated = sum(fill_adaptive(grid, engine, self._points,
+                                              radii[i] / self.scale, self.adaptive_tolerance,
+                                              prog_bar, self._index, workers)
+                                for i, grid in zip(missing, targets))
+                self.evaluated_fraction = evaluated / max(len(missing) * grid_height *
+                                                          grid_width, 1)
+                self._verboseprint("Adaptive refinement evaluated {:.1%} of the cells".format(
+                                   self.evaluated_fraction))
+            phase["cells"] = evaluated
+
+        for i, grid in zip(missing, targets):
+            grids[i] = grid.load() if isinstance(grid, GridFile) else grid
+            if isinstance(grid, SparseGrid):
+                self._verboseprint("Sparse grid keeps {} of {} tiles, {} bytes".format(
+                                   len(grid.tiles), grid.tile_rows * grid.tile_cols,
+                                   grid.nbytes))
+            if grid_cache:
+                grid_cache.store_grid(grid_keys[i], grids[i])
+        if grid_cache:
+            self._report_cache("Grid", grid_cache)
+        return grids
+
+    def sweep(self, radii: Union[List[float], None] = None,
+              scales: Union[List[float], None] = None,
+              colourmaps: Union[List[str], None] = None, output_dir: str = ".",
+              legend_loc: Union[str, int, None] = None, legend_fontsize: int = 14,
+              engine: Union[str, None] = None, dpi: int = DEFAULT_DPI) -> List[str]:
+        """
+        Renders the map of every value column for every combination of
+        radius, scale and colourmap into output_dir, the current radius,
+        scale and default colourmap being used for the lists left out
+        The dataset is only loaded once, and at each scale the grids of
+        every radius are filled in one pass sharing the point lookups and
+        distances of the largest radius. The images are written by a pool
+        of workers processes, headless at the given dpi. Returns the paths
+        of the images.
+        """
+        engine = self.engine if engine == None else engine
+        assert engine in ENGINES + [AUTO_ENGINE], "invalid engine"
+        radii = [self.radius] if not radii else list(radii)
+        scales = [self.scale] if not scales else list(scales)
+        # colourmaps only apply to weighted maps
+        colourmaps = [None] if not colourmaps or self._mode == MODES[0] else colourmaps
+        os.makedirs(output_dir, exist_ok=True)
+        radius_set, scale_set = self.radius, self.scale
+        grids_set = getattr(self, "_grids", None)
+        grid_state_set, dirty_set = self._grid_state, self._dirty
+        stem = (os.path.splitext(os.path.basename(self._filepath))[0]
+                if self._filepath else "heatmap")
+
+        tasks = []
         try:
-            import progressbar # displays progress nicely if installed
-            prog_bar = progressbar.ProgressBar()
-        except ImportError:
-            prog_bar = lambda l: l
-        for i in prog_bar(range(grid_height)):
-            for j in range(grid_width):
-                radius = self.radius / self.scale
-                vicinity = [[point_i, 
-                            sqrt((x_coords[point_i] - j) ** 2 +
-                            (y_coords[point_i] - i) ** 2)] 
-                            for point_i in range(item_count)]
-                if [item for item in vicinity if item[1] <= radius]:
-                    vicinity = [[point_i, 0.999 - point_dist / radius]
-                                for point_i, point_dist in vicinity
-                                if point_dist <= radius]
-                    # influence mode
-                    if self._mode == MODES[0]:
-                        weights = Counter()
-                        for point_i, weighted_dist in vicinity:
-                            weights[self._values[point_i]] += weighted_dist
-                        weights = list(weights.items())
-                        weights.sort(key=lambda item: item[1], reverse=True)
-                        dominant = weights[0]
-                        d_value = dominant[0]
-                        d_weight = dominant[1]
-                        # sum of the other weights
-                        rest = sum([weight for value, weight in weights[1:]])
-                        if not d_weight < rest:
-                            total_weight = d_weight - rest
-                            grid[i][j] = (self._legend[d_value]
-                                          if total_weight >= 0.999
-                                          else self._legend[d_value] - (0.999 - total_weight))
-                    # weighted mode
-                    elif self._mode == MODES[1]:
-                        total_count = 0
-                        for point_i, weighted_dist in vicinity:
-                            total_count += weighted_dist * self._values[point_i]
-                        grid[i][j] = total_count
-        
-        self.grid = grid
+            for scale in scales:
+                # the points and their index are placed for the largest radius,
+                # which covers the lookups of the smaller ones
+                self.scale, self.radius = scale, max(radii)
+                self._initialize_data()
+                reserve_radius(self.radius / self.scale)
+                for radius, grids in zip(radii, self._compute_grids(radii, engine)):
+                    self.radius = radius
+                    self._set_grid(grids)
+                    for column, value_col in enumerate(self._value_cols()):
+                        for colourmap in colourmaps:
+                            name = "{} {}s {}vc {}r{}.png".format(
+                                   stem, scale, value_col + 1, radius,
+                                   "" if colourmap == None else " {} cmap".format(colourmap))
+                            tasks.append(self._render_task(os.path.join(output_dir, name),
+                                                           column, colourmap, legend_loc,
+                                                           legend_fontsize, dpi))
+        finally:
+            self.radius, self.scale = radius_set, scale_set
+            # the grids and points go back to the scale and radius set
+            if grids_set is None:
+                for name in ("grid", "_grids"):
+                    self.__dict__.pop(name, None)
+                self._grid_state, self._dirty = None, None
+            else:
+                self._initialize_data()
+                self._set_grid(grids_set, grid_state_set)
+                self._dirty = dirty_set
+
+        self._verboseprint("Writing {} map(s) to {}...".format(len(tasks), output_dir))
+        if self.workers <= 1:
+            return [render_map(task) for task in tasks]
+        with ProcessPoolExecutor(self.workers) as pool:
+            return list(pool.map(render_map, tasks))
+
+    def _set_grid(self, grids: np.ndarray, grid_state: Union[tuple, None] = None) -> None:
+        """
+        Sets the grids of the value columns, one per value column stacked
+        grid_state is the _grid_key the grids were computed with, if they
+        can be updated when points change
+        """
+        self._grids = grids
+        self._grid_state, self._dirty = grid_state, None if grid_state == None else []
+        self.grid = grids[0] if isinstance(self.value_col, int) else grids
+
+    @property
+    def grids(self) -> Dict[str, np.ndarray]:
+        """
+        Get the grid of each value column, by the label of the column
+        """
+        return dict(zip(self._labels, self._grids))
+
+    def _column(self, column: Union[int, str, None]) -> int:
+        """
+        Returns the position of a value column given by its position
+        or label, the first value column if None
+        """
+        if column == None:
+            return 0
+        if isinstance(column, str):
+            assert column in self._labels, "unknown value column"
+            return self._labels.index(column)
+        assert 0 <= column < len(self._labels), "unknown value column"
+        return column
+
+    def _display_grid(self, column: int = 0) -> np.ndarray:
+        """
+        Returns the grid of a value column thinned out to at most
+        MAX_DISPLAY_CELLS cells, only reading the cells shown when
+        the grid is memory mapped or sparse
+        """
+        grid = self._grids[column]
+        step = max(1, ceil(sqrt(grid.size / MAX_DISPLAY_CELLS)))
+        if isinstance(grid, SparseGrid):
+            return grid.take(np.arange(0, grid.shape[0], step),
+                             np.arange(0, grid.shape[1], step))
+        return np.ascontiguousarray(grid[::step, ::step])
     
-    def display_map(self, colourmap: Union[str, Colormap, None] = None,
-                    legend_loc: Union[str, int, None] = None,
-                    legend_fontsize: int = 14) -> None:
+    def rgba_image(self, column: Union[int, str, None] = None,
+                   colourmap: Union[str, "Colormap", None] = None) -> np.ndarray:
         """
-        Uses matplotlib to display the map
-        Requires matplotlib and basemap to be installed basemap.in order to function
+        Returns the grid of a value column as rgba bytes, north up,
+        without going through matplotlib
+        colourmap only applies to weighted maps
         """
-        from mpl_toolkits.basemap import Basemap
-        from matplotlib.patches import Patch
-        import matplotlib.pyplot as plt
+        colourmap = "viridis_r" if colourmap == None else colourmap
+        grid = self._grids[self._column(column)]
+        with self.instrumentation.phase("colourmap", rows=grid.shape[0], cols=grid.shape[1]):
+            # split grids are coloured straight from their planes
+            return grid_to_rgba(grid if isinstance(grid, SplitGrid) else np.asarray(grid),
+                                self._mode, colourmap)[::-1]
 
+    def tile_exporter(self, directory: str, column: Union[int, str, None] = None,
+                      colourmap: Union[str, "Colormap", None] = None) -> TileExporter:
+        """
+        Returns the exporter of the web map tiles of the grid of a value
+        column into directory, to write them all or one at a time on demand
+        """
         colourmap = "viridis_r" if colourmap == None else colourmap
-        legend_loc = "best" if legend_loc == None else legend_loc
-        assert legend_loc in LEGEND_LOCATIONS
+        return TileExporter(directory, self._grids[self._column(column)], self._mode,
+                            (self._lat_min, self._lon_min, self._lat_max, self._lon_max),
+                            self.scale, colourmap)
 
-        plt.figure(figsize=FIGSIZE)
+    def export_tiles(self, directory: str, zooms: Union[List[int], None] = None,
+                     column: Union[int, str, None] = None,
+                     colourmap: Union[str, "Colormap", None] = None) -> List[str]:
+        """
+        Writes the grid of a value column as z/x/y web map tiles into
+        directory, from the workers processes, returns the paths written
+        zooms defaults to the native zoom level of the scale and the
+        four levels above it
+        """
+        if zooms == None:
+            zoom = native_zoom(self.scale)
+            zooms = list(range(max(zoom - 4, 0), zoom + 1))
+        self._verboseprint("Writing tiles for zoom level(s) {} to {}...".format(
+                           ", ".join(str(zoom) for zoom in zooms), directory))
+        prog_bar = _progress_bar()
+        return self.tile_exporter(directory, column, colourmap).export(
+            zooms, self.workers, prog_bar)
 
-        m = Basemap(projection="merc", resolution="i",
-                            llcrnrlat=self._lat_min, llcrnrlon=self._lon_min,
-                            urcrnrlat=self._lat_max, urcrnrlon=self._lon_max)
-        
-        m.drawcountries()
-        m.fillcontinents(color="white", lake_color="#1c9ef7", alpha=.1)
-        m.drawcoastlines()
-        m.drawrivers(color="#1c9ef7")
+    def _render_task(self, filepath: Union[str, None], column: Union[int, str, None],
+                     colourmap: Union[str, "Colormap", None],
+                     legend_loc: Union[str, int, None], legend_fontsize: int,
+                     dpi: int = DEFAULT_DPI) -> MapRender:
+        """
+        Returns everything needed to draw the map of a value column
+        """
+        colourmap = "viridis_r" if colourmap == None else colourmap
+        legend_loc = "best" if legend_loc == None else legend_loc
+        assert legend_loc in LEGEND_LOCATIONS
+        column = self._column(column)
+        return MapRender(filepath, self._display_grid(column), self._mode,
+                         (self._lat_min, self._lon_min, self._lat_max, self._lon_max),
+                         self._legends[column], self._labels[column], colourmap,
+                         legend_loc, legend_fontsize, dpi,
+                         os.path.join(self.cache_dir, "backgrounds")
+                         if self.cache_dir else None, self.instrumentation)
 
-        if self._mode == MODES[0]:
-            m.imshow(self.grid, alpha=1, vmin=0, vmax=len(COLOURS),
-                     cmap=get_unified_colourmap())
+    def display_map(self, colourmap: Union[str, "Colormap", None] = None,
+                    legend_loc: Union[str, int, None] = None,
+                    legend_fontsize: int = 14,
+                    column: Union[int, str, None] = None) -> None:
+        """
+        Uses matplotlib to display the map
+        column picks the value column shown, by position or label
+        Requires matplotlib and basemap to be installed basemap.in order to function
+        """
+        import matplotlib.pyplot as plt
 
-            legend_items = []
-            for name, value in self._legend.items():
-                legend_items.append(Patch(color=COLOURS[value - 1], label=name))
-            plt.legend(handles=legend_items, loc=legend_loc, fontsize=legend_fontsize)
+        draw_map(self._render_task(None, column, colourmap, legend_loc, legend_fontsize))
+        plt.show()
 
-        elif self._mode == MODES[1]:
-            img = m.imshow(self.grid, alpha=1, cmap=colourmap)
-            plt.colorbar(img)
-            plt.title(list(self._legend.keys())[0], size=30)
+    def save_map(self, filepath: str, colourmap: Union[str, "Colormap", None] = None,
+                 legend_loc: Union[str, int, None] = None,
+                 legend_fontsize: int = 14,
+                 column: Union[int, str, None] = None,
+                 dpi: int = DEFAULT_DPI) -> str:
+        """
+        Writes the map to an image file at the given dpi instead of displaying
+        it, without needing a display. The map features are drawn once per
+        extent and reused for every later map of the same extent.
+        """
+        return render_map(self._render_task(filepath, column, colourmap,
+                                            legend_loc, legend_fontsize, dpi))
 
-        plt.show()
         
 if __name__ == "__main__":
     from main import main
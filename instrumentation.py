@@ -0,0 +1,145 @@
+"""
+instrumentation module for heatmap
+
+The phases of generating a heatmap (loading the csv, preparing the data,
+placing the points, filling in the grid, building colours, setting up the
+basemap and rendering) are wrapped in instrumentation.phase(name). The
+default instrumentation does nothing and measures nothing. Sinks measure
+each phase and receive it as an event, a dict holding:
+
+    phase - name of the phase
+    time - unix time the phase ended at
+    wall - wall time the phase took, in seconds
+    cpu - cpu time the process spent in the phase, in seconds
+    peak_memory - peak resident memory of the process so far, in bytes,
+                  None where the platform doesn't report it
+    pid - process the phase ran in
+    and the fields given by the phase, like the grid dimensions and the
+    amount of cells evaluated
+"""
+from typing import Union
+import json
+import os
+import sys
+import time
+try:
+    import resource # not available on windows
+except ImportError:
+    resource = None
+
+
+def peak_memory() -> Union[int, None]:
+    """
+    Returns the peak resident memory of the process so far, in bytes
+    """
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macos and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _NoPhase:
+    """
+    Phase of the default instrumentation, ignoring everything
+    """
+    def __enter__(self) -> "_NoPhase":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def __setitem__(self, field: str, value: object) -> None:
+        pass
+
+_NO_PHASE = _NoPhase()
+
+
+class Phase(dict):
+    """
+    Phase being measured, a dict of the fields of its event which can be
+    added to while it runs, emitted to its instrumentation when it ends
+
+    instrumentation - instrumentation the event is emitted to
+    _start - wall and cpu time the phase started at
+    """
+    instrumentation: "Instrumentation"
+    _start: tuple
+
+    def __init__(self, instrumentation: "Instrumentation", name: str, **fields) -> None:
+        """
+        Initializes a new phase
+        """
+        super().__init__(phase=name, **fields)
+        self.instrumentation, self._start = instrumentation, None
+
+    def __enter__(self) -> "Phase":
+        self._start = (time.perf_counter(), time.process_time())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        wall, cpu = self._start
+        self.update(time=time.time(), wall=time.perf_counter() - wall,
+                    cpu=time.process_time() - cpu, peak_memory=peak_memory(),
+                    pid=os.getpid())
+        if exc[0] is not None:
+            self["error"] = exc[0].__name__
+        self.instrumentation.emit(dict(self))
+
+
+class Instrumentation:
+    """
+    Default instrumentation, doing nothing; sinks override emit to receive
+    the events of the phases, and set enabled so that phases are measured
+
+    Instrumentation is sent along with work given to other processes, so
+    sinks have to be picklable
+    """
+    enabled = False
+
+    def phase(self, name: str, **fields) -> Union[Phase, _NoPhase]:
+        """
+        Returns the context measuring a phase, fields being added to its
+        event, which can be added to through the context as well:
+
+            with instrumentation.phase("grid fill", rows=rows) as phase:
+                phase["cells"] = cells
+        """
+        if not self.enabled:
+            return _NO_PHASE
+        return Phase(self, name, **fields)
+
+    def emit(self, event: dict) -> None:
+        """
+        Receives the event of a phase that ended
+        """
+        pass
+
+NO_INSTRUMENTATION = Instrumentation()
+
+
+class JsonLinesSink(Instrumentation):
+    """
+    Instrumentation appending each event as a line of json to a file,
+    which several processes can append to at once
+
+    filepath - file the events are appended to
+    """
+    filepath: str
+
+    enabled = True
+
+    def __init__(self, filepath: str) -> None:
+        """
+        Initializes a new sink appending to filepath
+        """
+        self.filepath = filepath
+
+    def emit(self, event: dict) -> None:
+        """
+        Appends the event to the file
+        """
+        line = json.dumps(event, default=str) + "\n"
+        # a single write in append mode keeps lines of several processes whole
+        with open(self.filepath, "a") as file:
+            file.write(line)
@@ -3,15 +3,52 @@
 entry point for heatmap program
 """
 import argparse
-from matplotlib.cm import get_cmap
+import json
+import os
 from utilities import verify_dataset
+from instrumentation import JsonLinesSink, NO_INSTRUMENTATION
+from cache import DEFAULT_CACHE_BYTES
+from planner import AUTO_ENGINE, DEFAULT_MAX_SECONDS, OverBudget, default_max_bytes
 from heatmap import (Heatmap, DEFAULT_NAME_COL, 
                      DEFAULT_LAT_COL, DEFAULT_LON_COL, DEFAULT_VALUE_COL,
-                     DEFAULT_SCALE, DEFAULT_RADIUS, MODES, LEGEND_LOCATIONS)
+                     DEFAULT_SCALE, DEFAULT_RADIUS, MODES, LEGEND_LOCATIONS,
+                     ENGINES, ENCODINGS, DEFAULT_DPI)
 
 BORDER_MODES = ["entire", "specific", "both"]
+DEFAULT_BORDER_OFFSET = 0.03
 
-def main():
+def parse_columns(text):
+    """
+    Parses a column number, or a comma separated list of them
+    """
+    columns = [int(col) for col in text.split(",")]
+    return columns[0] if len(columns) == 1 else columns
+
+def parse_zooms(text):
+    """
+    Parses zoom levels given as a range like 6-12 or a comma separated list
+    """
+    if "-" in text:
+        first, last = text.split("-")
+        return list(range(int(first), int(last) + 1))
+    return [int(zoom) for zoom in text.split(",")]
+
+def job_arguments(job):
+    """
+    Turns a job of a job file, options by their long name, into command
+    line arguments
+    """
+    arguments = []
+    for name, value in job.items():
+        if value is None or value is False:
+            continue
+        arguments.append("--" + name)
+        if value is not True:
+            arguments.append(",".join(str(v) for v in value)
+                             if isinstance(value, list) else str(value))
+    return arguments
+
+def build_parser():
     parser = argparse.ArgumentParser(description=("Generates a heatmap from "
                                                   "data and displays it"))
     parser.add_argument("-v", "--verbose", action="store_true")
@@ -31,16 +68,100 @@ def main():
     parser.add_argument("-cmap", "--colourmap")
     parser.add_argument("-lloc", "--legend_location")
     parser.add_argument("-lfs", "--legend_fontsize")
+    parser.add_argument("-e", "--engine", choices=ENGINES + [AUTO_ENGINE],
+                        default=AUTO_ENGINE,
+                        help="engine filling in the grid, auto picks the fastest one")
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("-gf", "--grid_file")
+    parser.add_argument("-cd", "--cache_dir")
+    parser.add_argument("-cs", "--cache_size", type=float,
+                        default=DEFAULT_CACHE_BYTES / 2 ** 20,
+                        help="size each cache of the cache directory is trimmed "
+                             "down to, in MB")
+    parser.add_argument("-sp", "--sparse", action="store_true",
+                        help="only store the parts of the grid some point reaches")
+    parser.add_argument("-at", "--adaptive_tolerance", type=float,
+                        help="fill in blocks of the grid whose sampled cells differ by at "
+                             "most this much instead of evaluating every cell")
+    parser.add_argument("-enc", "--encoding", choices=ENCODINGS, default=ENCODINGS[0],
+                        help="how grid cells are stored, uint8 and uint16 split "
+                             "influence grids into a legend number and a fade")
+    parser.add_argument("-ev", "--events",
+                        help="json lines file to append the timings of each phase to")
+    parser.add_argument("-mt", "--max_time", type=float, default=DEFAULT_MAX_SECONDS,
+                        help="refuse grids predicted to take longer, in seconds")
+    parser.add_argument("-mm", "--max_memory", type=float,
+                        help="refuse grids predicted to need more memory, in MB, "
+                             "defaults to half of the physical memory")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="calculate grids over the time and memory budget")
+    parser.add_argument("-sr", "--sweep_radii",
+                        help="comma separated radii to write a map for each")
+    parser.add_argument("-ss", "--sweep_scales",
+                        help="comma separated scales to write a map for each")
+    parser.add_argument("-scmap", "--sweep_colourmaps",
+                        help="comma separated colourmaps to write a map for each")
+    parser.add_argument("-o", "--output_dir", default=".",
+                        help="directory the swept maps are written to")
+    parser.add_argument("-sm", "--save_map",
+                        help="image file to write the map to instead of displaying it")
+    parser.add_argument("-dpi", "--dpi", type=int, default=DEFAULT_DPI,
+                        help="resolution of the written maps")
+    parser.add_argument("-t", "--tiles_dir",
+                        help="directory to write z/x/y web map tiles to instead of "
+                             "displaying the map")
+    parser.add_argument("-z", "--zooms",
+                        help="zoom levels of the tiles, as a range like 6-12 "
+                             "or a comma separated list")
+    parser.add_argument("-ba", "--batch", action="store_true",
+                        help="never ask for anything: options left out take their "
+                             "defaults, invalid ones stop the run and the map is "
+                             "only written, never displayed")
+    parser.add_argument("-j", "--jobs",
+                        help="json file holding a list of jobs to run in batch mode, "
+                             "each an object of long option names, on top of the "
+                             "options given on the command line")
+    return parser
 
+def main():
+    parser = build_parser()
     args = parser.parse_args()
+    if not args.jobs:
+        try:
+            run(args)
+        except (AssertionError, ValueError, OSError, IndexError, KeyError) as err:
+            if not args.batch:
+                raise
+            parser.error(str(err))
+        return
+
+    with open(args.jobs) as file:
+        jobs = json.load(file)
+    assert isinstance(jobs, list), "the job file must hold a list of jobs"
+    for number, job in enumerate(jobs, 1):
+        job_args = parser.parse_args(job_arguments(job) + ["--batch"],
+                                     namespace=argparse.Namespace(**vars(args)))
+        job_args.jobs = None
+        print("Job {} of {}".format(number, len(jobs)))
+        try:
+            run(job_args)
+        except (AssertionError, ValueError, OSError, IndexError, KeyError) as err:
+            # stops at the first failure, like a failing command would
+            print("Job {} failed: {}".format(number, err))
+            raise SystemExit(1)
 
+def run(args):
+    """
+    Generates the heatmap the options ask for, asking for the missing
+    ones unless in batch mode
+    """
     dataset = args.dataset
     mode = args.mode.lower() if args.mode else None
     mode = None if mode not in MODES else mode
     name_col = int(args.name_col) if args.name_col else None
     lat_col = int(args.lat_col) if args.lat_col else None
     lon_col = int(args.lon_col) if args.lon_col else None
-    value_col = int(args.value_col) if args.value_col else None
+    value_col = parse_columns(args.value_col) if args.value_col else None
     scale = float(args.scale) if args.scale else None
     radius = float(args.radius) if args.radius else None
     border_offset = float(args.border_offset) if args.border_offset else None
@@ -52,6 +173,34 @@ def main():
     legend_location = args.legend_location if args.legend_location else None
     legend_location = None if legend_location not in LEGEND_LOCATIONS else legend_location
     legend_fontsize = int(args.legend_fontsize) if args.legend_fontsize else None
+    sweep_radii = ([float(r) for r in args.sweep_radii.split(",")]
+                   if args.sweep_radii else None)
+    sweep_scales = ([float(s) for s in args.sweep_scales.split(",")]
+                    if args.sweep_scales else None)
+    sweep_colourmaps = args.sweep_colourmaps.split(",") if args.sweep_colourmaps else None
+    sweeping = bool(sweep_radii or sweep_scales or sweep_colourmaps)
+    # swept values need not be asked for
+    radius = sweep_radii[0] if sweep_radii and radius == None else radius
+    scale = sweep_scales[0] if sweep_scales and scale == None else scale
+    colourmap = sweep_colourmaps[0] if sweep_colourmaps else colourmap
+
+    if args.batch:
+        # options left out take the defaults a blank answer gives
+        assert dataset, "no dataset given"
+        verify_dataset(dataset)
+        assert args.mode == None or mode != None, "invalid mode"
+        assert args.legend_location == None or legend_location != None, \
+            "invalid legend location"
+        mode = MODES[0] if mode == None else mode
+        name_col = DEFAULT_NAME_COL + 1 if name_col == None else name_col
+        lat_col = DEFAULT_LAT_COL + 1 if lat_col == None else lat_col
+        lon_col = DEFAULT_LON_COL + 1 if lon_col == None else lon_col
+        value_col = DEFAULT_VALUE_COL + 1 if value_col == None else value_col
+        scale = DEFAULT_SCALE if scale == None else scale
+        radius = DEFAULT_RADIUS if radius == None else radius
+        if (border_offset == None and north_offset == None and south_offset == None
+            and east_offset == None and west_offset == None):
+            border_offset = DEFAULT_BORDER_OFFSET
 
     while dataset == None:
         try:
@@ -108,8 +257,9 @@ def main():
     while value_col == None:
         try:
             value_col = input(("What column are the values in? "
+                             "Separate several columns with commas. "
                              "Leave blank for column {}: ".format(DEFAULT_VALUE_COL + 1)))
-            value_col = DEFAULT_VALUE_COL + 1 if value_col == "" else int(value_col)
+            value_col = DEFAULT_VALUE_COL + 1 if value_col == "" else parse_columns(value_col)
         except Exception as err:
             value_col = None
             print("Error: {}. Please try again.".format(err))
@@ -158,8 +308,10 @@ def main():
             while border_offset == None:
                 try:
                     border_offset = input(("What is the border offset of the map? "
-                                           "Leave blank for default of 0.03: "))
-                    border_offset = 0.03 if border_offset == "" else float(border_offset)
+                                           "Leave blank for default of {}: ".format(
+                                           DEFAULT_BORDER_OFFSET)))
+                    border_offset = (DEFAULT_BORDER_OFFSET if border_offset == ""
+                                     else float(border_offset))
                 except Exception:
                     border_offset = None
                     print("Please input a valid number.")
@@ -207,12 +359,65 @@ def main():
     east_offset = 0 if east_offset == None else east_offset
     west_offset = 0 if west_offset == None else west_offset
 
+    value_col = (value_col - 1 if isinstance(value_col, int)
+                 else [col - 1 for col in value_col])
     heatmap = Heatmap(dataset, mode, name_col - 1, lat_col - 1, lon_col - 1,
-                      value_col - 1, scale, radius, border_offset, 
+                      value_col, scale, radius, border_offset, 
                       north_offset, south_offset, east_offset, west_offset,
-                      args.verbose)
-    
-    heatmap.calculate_grid()
+                      args.verbose, args.engine, args.workers,
+                      args.grid_file, args.cache_dir, args.sparse,
+                      args.adaptive_tolerance,
+                      JsonLinesSink(args.events) if args.events else NO_INSTRUMENTATION,
+                      None if args.force else args.max_time,
+                      None if args.force else
+                      default_max_bytes() if args.max_memory == None else
+                      int(args.max_memory * 2 ** 20), args.encoding,
+                      int(args.cache_size * 2 ** 20))
+
+    try:
+        if sweeping:
+            for path in heatmap.sweep(sweep_radii, sweep_scales, sweep_colourmaps,
+                                      args.output_dir, legend_location,
+                                      legend_fontsize if legend_fontsize else 14,
+                                      dpi=args.dpi):
+                print(path)
+            return
+
+        print("Predicted: {}".format(heatmap.plan_grid().summary()))
+        heatmap.calculate_grid()
+    except OverBudget as err:
+        message = "Refusing a grid {}. Use --force to calculate it anyway.".format(err)
+        if args.batch:
+            # fails the run, which stops a job file at the refused grid
+            raise OverBudget(message) from err
+        print(message)
+        return
+    if args.adaptive_tolerance != None:
+        print("Evaluated {:.1%} of the cells".format(heatmap.evaluated_fraction))
+
+    if args.tiles_dir:
+        zooms = parse_zooms(args.zooms) if args.zooms else None
+        for column in range(1 if isinstance(value_col, int) else len(value_col)):
+            directory = (args.tiles_dir if isinstance(value_col, int)
+                         else os.path.join(args.tiles_dir, str(value_col[column] + 1)))
+            paths = heatmap.export_tiles(directory, zooms, column, colourmap)
+            print("{} tile(s) written to {}".format(len(paths), directory))
+        return
+
+    if args.save_map:
+        # written headless, without asking for the display settings
+        print(heatmap.save_map(args.save_map, colourmap, legend_location,
+                               legend_fontsize if legend_fontsize else 14,
+                               dpi=args.dpi))
+        return
+
+    if args.batch:
+        # nothing to display the map to
+        print("Calculated {} grid(s) of {} x {} cells{}".format(
+              1 if isinstance(value_col, int) else len(value_col),
+              heatmap.grid.shape[-2], heatmap.grid.shape[-1],
+              " into {}".format(args.grid_file) if args.grid_file else ""))
+        return
 
     if mode == MODES[0]:
         while legend_location == None:
@@ -248,12 +453,14 @@ def main():
                 colourmap = input(("Please specify a colourmap. "
                                    "Leave blank for default of viridis: "))
                 colourmap = "viridis" if colourmap == "" else colourmap
-                get_cmap(colourmap)
+                from matplotlib import colormaps
+                colormaps[colourmap]
             except Exception as err:
                 colourmap = None
                 print("Error: {}. Please try again.".format(err))
 
-    heatmap.display_map(colourmap, legend_location, legend_fontsize)
+    for column in range(1 if isinstance(value_col, int) else len(value_col)):
+        heatmap.display_map(colourmap, legend_location, legend_fontsize, column)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""
+cost planner module for heatmap
+
+Predicts how long filling in grids takes and how much memory it needs
+before any cell is computed, from the dimensions of the grids, the amount
+of points and the search radius. Every engine has a cost model made of
+the time it takes per distance computed, per point handled in a band of
+rows and per cell resolved, measured on a single core. The planner picks
+the cheapest engine, fills bands in parallel only when it pays off the
+start of the worker processes, and refuses jobs going over a budget.
+
+Predictions are rough, they tell a minute long job from a day long one.
+Adaptive refinement is only planned when it is predicted to be cheaper
+than the cheapest engine filling in every cell, and it is predicted on
+the expensive side so that it doesn't slip past a budget.
+"""
+from typing import Dict, List, Union
+from math import ceil, floor, pi
+import os
+from engines import ENGINES, BAND_ROWS, BLOCK_SIZE, KERNEL_CACHE
+from sparse import TILE_CELLS
+
+# engine picking the cheapest engine for each job
+AUTO_ENGINE = "auto"
+STORAGES = ["memory", "sparse", "file"]
+# seconds per distance computed, per point handled in a band of rows and
+# per cell of a value resolved, of each engine in each mode
+ENGINE_COSTS = {"influence": {"vectorized": (1.7e-8, 1.7e-5, 2e-8),
+                              "splat": (2e-9, 2.6e-5, 2e-8),
+                              "loop": (2e-6, 1e-4, 2e-6)},
+                "weighted": {"vectorized": (1.1e-8, 0.0, 0.0),
+                             "splat": (2e-9, 1.2e-5, 1.2e-8),
+                             "loop": (2e-6, 0.0, 1e-5)}}
+# seconds it takes to start the worker processes and hand out the points
+POOL_STARTUP = 0.5
+BYTES_PER_CELL = 8
+# temporaries of the vectorized engine, a few arrays of BLOCK_SIZE floats
+WORKING_BYTES = 4 * BLOCK_SIZE * 8
+# bytes per cell of the splat distance field, of each kernel kept (its
+# weights and mask) and of the temporaries of building a kernel
+FIELD_BYTES = 8
+KERNEL_BYTES = 9
+KERNEL_TEMPORARY_BYTES = 17
+# share of the cells adaptive refinement is assumed to refine with the
+# engine, on top of sampling the grid with the vectorized engine
+ADAPTIVE_REFINED = 0.5
+DEFAULT_MAX_SECONDS = 3600
+
+
+def physical_memory() -> Union[int, None]:
+    """
+    Returns the amount of physical memory, in bytes, None where it
+    can't be told
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_max_bytes() -> Union[int, None]:
+    """
+    Returns the default memory budget, half of the physical memory
+    """
+    memory = physical_memory()
+    return None if memory == None else memory // 2
+
+
+class OverBudget(ValueError):
+    """
+    Raised for jobs predicted to go over their time or memory budget
+    """
+    pass
+
+
+class Plan:
+    """
+    Predicted cost of filling in grids, and how to fill them in
+
+    mode - data parsing mode of the grids
+    rows - amount of rows of each grid
+    cols - amount of columns of each grid
+    grids - amount of grids filled in, for every value column and radius
+    points - amount of distinct points
+    radius - largest search radius, in grid cells
+    points_per_cell - average amount of points in range of a cell
+    storage - where the grids are kept, one of STORAGES
+    engine - cheapest engine allowed
+    adaptive - whether the grids are filled in with adaptive refinement,
+               refining with the engine
+    workers - amount of processes filling in the grids
+    seconds - predicted time to fill in the grids
+    bytes - predicted peak memory of the grids and their computation
+    costs - predicted seconds of every engine allowed, on one process
+    """
+    mode: str
+    rows: int
+    cols: int
+    grids: int
+    points: int
+    radius: float
+    points_per_cell: float
+    storage: str
+    engine: str
+    adaptive: bool
+    workers: int
+    seconds: float
+    bytes: int
+    costs: Dict[str, float]
+
+    def __init__(self, mode: str, rows: int, cols: int, grids: int, points: int,
+                 radius: float, storage: str, costs: Dict[str, float],
+                 workers: int, seconds: float, bytes: int,
+                 adaptive: bool = False) -> None:
+        """
+        Initializes a new plan, the engine being the cheapest of costs
+        """
+        self.mode, self.rows, self.cols, self.grids = mode, rows, cols, grids
+        self.points, self.radius, self.storage = points, radius, storage
+        self.points_per_cell = points * pi * radius ** 2 / max(rows * cols, 1)
+        self.costs, self.engine = costs, min(costs, key=costs.get)
+        self.workers, self.seconds, self.bytes = workers, seconds, bytes
+        self.adaptive = adaptive
+
+    def summary(self) -> str:
+        """
+        Returns the plan described in a line
+        """
+        return ("{} grid(s) of {} x {} cells, {:.1f} point(s) per cell: "
+                "about {} and {} with the {} engine{} on {} worker(s)").format(
+                self.grids, self.rows, self.cols, self.points_per_cell,
+                format_seconds(self.seconds), format_bytes(self.bytes),
+                self.engine, ", adaptively," if self.adaptive else "", self.workers)
+
+    def check(self, max_seconds: Union[float, None] = None,
+              max_bytes: Union[int, None] = None) -> None:
+        """
+        Raises OverBudget if the job is predicted to take longer than
+        max_seconds or more memory than max_bytes, None being no limit
+        """
+        if max_seconds != None and self.seconds > max_seconds:
+            raise OverBudget("predicted to take {}, over the budget of {}: {}".format(
+                             format_seconds(self.seconds), format_seconds(max_seconds),
+                             self.summary()))
+        if max_bytes != None and self.bytes > max_bytes:
+            raise OverBudget(("predicted to need {}, over the budget of {}, "
+                              "sparse grids or a grid file need less: {}").format(
+                             format_bytes(self.bytes), format_bytes(max_bytes),
+                             self.summary()))
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    Returns an amount of seconds in the largest fitting unit
+    """
+    for unit, length in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= length:
+            return "{:.1f} {}(s)".format(seconds / length, unit)
+    return "{:.2f} second(s)".format(seconds)
+
+
+def format_bytes(amount: int) -> str:
+    """
+    Returns an amount of bytes in the largest fitting unit
+    """
+    for unit, size in (("GB", 2 ** 30), ("MB", 2 ** 20), ("KB", 2 ** 10)):
+        if amount >= size:
+            return "{:.1f} {}".format(amount / size, unit)
+    return "{} bytes".format(amount)
+
+
+def engine_seconds(engine: str, mode: str, points: int, values: int, rows: int,
+                   cols: int, radius: float) -> float:
+    """
+    Returns the predicted time for an engine to fill in one stack of grids
+    on one process, values being the amount of values of the points
+    (the payload columns)
+    """
+    per_distance, per_visit, per_cell = ENGINE_COSTS[mode][engine]
+    # every point is handled once in each band of rows it reaches
+    visits = points * min(2 * radius + BAND_ROWS, rows + BAND_ROWS) / BAND_ROWS
+    if engine == "vectorized":
+        # distances to every cell of the bands a point reaches
+        distances = points * min(2 * radius + BAND_ROWS, rows) * cols
+    elif engine == "splat":
+        # the cells of the kernel stamped around each point
+        distances = points * (2 * radius + 1) ** 2
+    else:
+        distances = points * pi * radius ** 2
+    cells = rows * cols * (values if engine != "loop" else 1)
+    return per_distance * distances + per_visit * visits + per_cell * cells
+
+
+def adaptive_seconds(engine: str, mode: str, points: int, values: int, rows: int,
+                     cols: int, radius: float) -> float:
+    """
+    Returns the predicted time of adaptive refinement refining with an
+    engine for one stack of grids on one process: every cell sampled with
+    the vectorized engine, which bounds the sampling, and ADAPTIVE_REFINED
+    of them refined with the engine
+    """
+    return (engine_seconds("vectorized", mode, points, values, rows, cols, radius) +
+            ADAPTIVE_REFINED * engine_seconds(engine, mode, points, values, rows, cols,
+                                              radius))
+
+
+def kernel_bytes(radius: float, radii: int = 1) -> int:
+    """
+    Returns the memory of the distance field and kernels the splat engine
+    keeps for radii search radii, radius being the largest one in grid cells
+    """
+    cells = (2 * floor(radius) + 1) ** 2
+    return cells * (FIELD_BYTES + KERNEL_BYTES * min(radii, KERNEL_CACHE) +
+                    KERNEL_TEMPORARY_BYTES)
+
+
+def plan_grid(mode: str, points: int, values: int, rows: int, cols: int,
+              radius: float, grids: int = 1, radii: int = 1, storage: str = STORAGES[0],
+              engines: List[str] = ENGINES, workers: int = 1,
+              cell_bytes: int = BYTES_PER_CELL, adaptive: bool = False) -> Plan:
+    """
+    Returns the plan of filling in the grids of radii search radii,
+    radius being the largest one in grid cells, grids the amount of grids
+    per radius and values the amount of values of the points
+    The plan uses the cheapest of engines, with up to workers processes
+    cell_bytes is the size of a cell of grids kept in memory
+    adaptive asks for adaptive refinement, planned if it is cheaper
+    """
+    assert storage in STORAGES, "invalid storage"
+    assert all(engine in ENGINES for engine in engines), "invalid engine"
+    costs = {engine: radii * engine_seconds(engine, mode, points, values, rows, cols, radius)
+             for engine in engines}
+    engine = min(costs, key=costs.get)
+    seconds = costs[engine]
+    if adaptive:
+        refined = radii * adaptive_seconds(engine, mode, points, values, rows, cols, radius)
+        adaptive = refined < seconds
+        seconds = min(seconds, refined)
+
+    grid_bytes = grids * radii * rows * cols * cell_bytes
+    if storage == "sparse":
+        # tiles around the points, at most every tile
+        reach = (ceil(2 * radius / TILE_CELLS) + 1) ** 2
+        tiles = min(points * reach, ceil(rows / TILE_CELLS) * ceil(cols / TILE_CELLS))
+        grid_bytes = grids * radii * tiles * TILE_CELLS ** 2 * BYTES_PER_CELL
+    elif storage == "file":
+        # only a band of rows is kept in memory
+        grid_bytes = grids * BAND_ROWS * cols * BYTES_PER_CELL
+    # influence layers hold a weight and a rank per value and cell of a band
+    band_bytes = radii * values * BAND_ROWS * cols * 12 if mode == "influence" else 0
+    working = WORKING_BYTES + band_bytes
+    if engine == "splat":
+        # every process builds its own distance field and kernels
+        working += kernel_bytes(radius, radii)
+
+    # bands, or tiles of sparse grids, are handed out to the workers
+    parts = (ceil(rows / BAND_ROWS) if storage != "sparse"
+             else ceil(rows / TILE_CELLS) * ceil(cols / TILE_CELLS))
+    usable = max(1, min(workers, parts, os.cpu_count() or 1))
+    chosen = 1
+    if usable > 1 and seconds / usable + POOL_STARTUP < seconds:
+        chosen, seconds = usable, seconds / usable + POOL_STARTUP
+    if chosen > 1 and storage == "memory":
+        # dense grids are filled in shared memory and copied back
+        grid_bytes += grids * radii * rows * cols * BYTES_PER_CELL
+    return Plan(mode, rows, cols, grids * radii, points, radius, storage, costs,
+                chosen, seconds, grid_bytes + chosen * working, adaptive)
@@ -0,0 +1,227 @@
+"""
+rendering module for heatmap
+
+Maps are either drawn through pyplot to be displayed, or rendered headless
+straight onto an Agg canvas and written to a file. Headless renders only
+draw the map features (countries, coastlines, rivers) once per extent and
+projection, and composite every grid over the cached raster of them.
+"""
+from typing import TYPE_CHECKING, Dict, Tuple, Union
+from functools import lru_cache
+import numpy as np
+from colourmaps import get_unified_colourmap, grid_to_rgba, COLOURS
+from cache import BackgroundCache
+from instrumentation import Instrumentation, NO_INSTRUMENTATION
+if TYPE_CHECKING:
+    from matplotlib.colors import Colormap
+
+FIGSIZE = (16, 10)
+DEFAULT_DPI = 100
+PROJECTION = "merc"
+RESOLUTION = "i"
+# amount of map backgrounds kept in memory by each process
+MAX_BACKGROUNDS = 16
+
+
+class MapRender:
+    """
+    Everything needed to draw the map of a grid, small enough
+    to be sent to another process
+
+    filepath - image file the map is written to, None when displayed
+    grid - grid to draw, thinned out for display
+    mode - data parsing mode of the grid
+    extent - lat_min, lon_min, lat_max and lon_max of the map
+    legend - value to number mapping of the grid
+    label - label of the value column of the grid
+    colourmap - colourmap of weighted grids
+    legend_loc - location of the legend of influence grids
+    legend_fontsize - fontsize of the legend of influence grids
+    dpi - resolution of the image file
+    cache_dir - directory to cache map backgrounds in, no caching on disk if None
+    instrumentation - receives the timings of the phases of rendering
+    """
+    filepath: Union[str, None]
+    grid: np.ndarray
+    mode: str
+    extent: Tuple[float, float, float, float]
+    legend: Dict[str, int]
+    label: str
+    colourmap: Union[str, "Colormap"]
+    legend_loc: Union[str, int]
+    legend_fontsize: int
+    dpi: int
+    cache_dir: Union[str, None]
+    instrumentation: Instrumentation
+
+    def __init__(self, filepath: Union[str, None], grid: np.ndarray, mode: str,
+                 extent: Tuple[float, float, float, float], legend: Dict[str, int],
+                 label: str, colourmap: Union[str, "Colormap"],
+                 legend_loc: Union[str, int], legend_fontsize: int,
+                 dpi: int = DEFAULT_DPI, cache_dir: Union[str, None] = None,
+                 instrumentation: Instrumentation = NO_INSTRUMENTATION) -> None:
+        """
+        Initializes a new map render
+        """
+        self.filepath, self.grid, self.mode = filepath, grid, mode
+        self.extent, self.legend, self.label = extent, legend, label
+        self.colourmap, self.legend_loc = colourmap, legend_loc
+        self.legend_fontsize, self.dpi, self.cache_dir = legend_fontsize, dpi, cache_dir
+        self.instrumentation = instrumentation
+
+
+def _basemap(extent: Tuple[float, float, float, float], ax=None):
+    """
+    Returns the basemap of the extent with the map features drawn onto ax,
+    or the current pyplot axes if ax is None
+    """
+    from mpl_toolkits.basemap import Basemap
+
+    lat_min, lon_min, lat_max, lon_max = extent
+    m = Basemap(projection=PROJECTION, resolution=RESOLUTION,
+                llcrnrlat=lat_min, llcrnrlon=lon_min,
+                urcrnrlat=lat_max, urcrnrlon=lon_max, ax=ax)
+
+    m.drawcountries()
+    m.fillcontinents(color="white", lake_color="#1c9ef7", alpha=.1)
+    m.drawcoastlines()
+    m.drawrivers(color="#1c9ef7")
+    return m
+
+
+def _draw_grid(render: MapRender, draw_image, figure, axes, cax=None) -> None:
+    """
+    Draws the grid of a render with draw_image, an imshow taking the
+    grid, along with its legend or colourbar and title
+    The colourbar is drawn in cax if given, or takes space from axes
+    """
+    from matplotlib.patches import Patch
+
+    if render.mode == "influence":
+        draw_image(render.grid, alpha=1, vmin=0, vmax=len(COLOURS),
+                   cmap=get_unified_colourmap())
+
+        legend_items = []
+        for name, value in render.legend.items():
+            legend_items.append(Patch(color=COLOURS[value - 1], label=name))
+        axes.legend(handles=legend_items, loc=render.legend_loc,
+                    fontsize=render.legend_fontsize)
+
+    elif render.mode == "weighted":
+        img = draw_image(render.grid, alpha=1, cmap=render.colourmap)
+        figure.colorbar(img, ax=axes, cax=cax)
+        axes.set_title(render.label, size=30)
+
+
+def draw_map(render: MapRender) -> None:
+    """
+    Draws the map onto a new pyplot figure, to be shown with plt.show()
+    Requires matplotlib and basemap to be installed in order to function
+    """
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=FIGSIZE)
+    with render.instrumentation.phase("basemap"):
+        m = _basemap(render.extent)
+    _draw_grid(render, m.imshow, figure, plt.gca())
+
+
+def _new_figure(dpi: int):
+    """
+    Returns a figure drawn by the Agg backend, without involving pyplot
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=FIGSIZE, dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+@lru_cache(maxsize=MAX_BACKGROUNDS)
+def map_background(extent: Tuple[float, float, float, float], dpi: int,
+                   colourbar: bool = False,
+                   cache_dir: Union[str, None] = None) -> Tuple[np.ndarray, tuple,
+                                                               Union[tuple, None]]:
+    """
+    Returns the raster of the map features of the extent, the position of
+    the map within it and the position of the colourbar if space is kept
+    for one, positions being left, bottom, width and height fractions
+    Rasters are kept in memory, and in cache_dir if it is given
+    """
+    cache = BackgroundCache(cache_dir) if cache_dir else None
+    if cache:
+        key = cache.background_key(extent, PROJECTION, RESOLUTION, FIGSIZE,
+                                   dpi, colourbar)
+        found = cache.load_background(key)
+        if found != None:
+            return found
+
+    from matplotlib.cm import ScalarMappable
+
+    figure = _new_figure(dpi)
+    axes = figure.add_subplot(111)
+    _basemap(extent, axes)
+    cax = None
+    if colourbar:
+        # lays the map out the way it is with a colourbar, without drawing it
+        cax = figure.colorbar(ScalarMappable(), ax=axes).ax
+        cax.set_visible(False)
+    figure.canvas.draw()
+    raster = np.array(figure.canvas.buffer_rgba())
+    # the basemap shrinks the axes to keep the aspect of the projection
+    position = tuple(float(x) for x in axes.get_position().bounds)
+    colourbar_position = (None if cax == None else
+                          tuple(float(x) for x in cax.get_position().bounds))
+    raster.flags.writeable = False
+
+    if cache:
+        cache.store_background(key, raster, position, colourbar_position)
+    return raster, position, colourbar_position
+
+
+def render_map(render: MapRender) -> str:
+    """
+    Writes the map to its filepath without a display, compositing the
+    grid over the cached map background, returns the filepath
+    Requires matplotlib, and basemap for backgrounds not cached on disk
+    """
+    with render.instrumentation.phase("render", mode=render.mode, dpi=render.dpi,
+                                      rows=render.grid.shape[0],
+                                      cols=render.grid.shape[1]):
+        return _composite_map(render)
+
+
+def _composite_map(render: MapRender) -> str:
+    """
+    Does the work of render_map
+    """
+    misses = map_background.cache_info().misses
+    with render.instrumentation.phase("basemap") as phase:
+        raster, position, colourbar_position = map_background(
+            tuple(render.extent), render.dpi, render.mode == "weighted", render.cache_dir)
+        phase["cached"] = map_background.cache_info().misses == misses
+    figure = _new_figure(render.dpi)
+    figure.figimage(raster, origin="upper")
+    # the axes are drawn over the background, which is a figure image
+    axes = figure.add_axes(position, zorder=1)
+    axes.set_axis_off()
+    cax = (None if colourbar_position == None
+           else figure.add_axes(colourbar_position, zorder=1))
+
+    def draw_image(grid, cmap=None, **kwargs):
+        # converted to rgba up front instead of going through the
+        # colourmap, and stretched over the map like basemap does
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.colors import Normalize
+
+        with render.instrumentation.phase("colourmap", rows=grid.shape[0],
+                                          cols=grid.shape[1]):
+            rgba = grid_to_rgba(grid, render.mode, render.colourmap)
+        axes.imshow(rgba, origin="lower", aspect="auto", extent=(0, 1, 0, 1))
+        return ScalarMappable(Normalize(np.nanmin(grid), np.nanmax(grid)),
+                              render.colourmap)
+
+    _draw_grid(render, draw_image, figure, axes, cax)
+    figure.savefig(render.filepath, dpi=render.dpi)
+    return render.filepath
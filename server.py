@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""
+local http server for heatmap
+
+Serves grids, maps and tiles of heatmaps whose parameters are given as
+query arguments, keeping the heatmaps of recent requests loaded and their
+grids computed between requests. Requests are read by an asyncio front
+end and computed by a pool of threads, duplicate requests arriving while
+one is being computed waiting for the same response. Only listens on
+localhost.
+
+    /grid?dataset=...        grid as a .npy file, split grids decoded
+    /image.png?dataset=...   grid as an image, north up
+    /map.png?dataset=...     map, rendered headless
+    /tiles/z/x/y.png?dataset=...   web map tile of the grid
+"""
+from typing import Callable, Dict, Tuple, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import io
+import os
+import threading
+from urllib.parse import parse_qsl, urlsplit
+import numpy as np
+from heatmap import Heatmap, MODES, DEFAULT_DPI
+from instrumentation import Instrumentation, JsonLinesSink, NO_INSTRUMENTATION
+from planner import DEFAULT_MAX_SECONDS, default_max_bytes
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+MAX_HEATMAPS = 8
+REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def parse_columns(text: str) -> Union[int, list]:
+    """
+    Parses a column number counted from 1, or a comma separated list
+    of them, into column indices
+    """
+    columns = [int(col) - 1 for col in text.split(",")]
+    return columns[0] if len(columns) == 1 else columns
+
+
+def parse_flag(text: str) -> bool:
+    """
+    Parses a query argument switching an option on or off
+    """
+    return text.lower() in ("1", "true", "yes", "on")
+
+
+# query arguments setting up a heatmap, with how they are parsed,
+# columns being numbered from 1 like the command line does
+HEATMAP_ARGS = {"dataset": os.path.abspath, "mode": str.lower,
+                "name_col": parse_columns, "lat_col": parse_columns,
+                "lon_col": parse_columns, "value_col": parse_columns,
+                "scale": float, "radius": float, "border_offset": float,
+                "north_offset": float, "south_offset": float,
+                "east_offset": float, "west_offset": float, "engine": str,
+                "sparse": parse_flag, "adaptive_tolerance": float,
+                "encoding": str.lower}
+# query arguments choosing how a heatmap is shown
+DISPLAY_ARGS = {"column": int, "colourmap": str, "legend_loc": str,
+                "legend_fontsize": int, "dpi": int}
+
+
+class HeatmapServer:
+    """
+    Serves heatmaps over http on localhost
+
+    port - port listened on
+    workers - amount of threads computing and rendering responses
+    cache_dir - directory the heatmaps cache datasets and grids in, no caching if None
+    max_heatmaps - amount of heatmaps kept loaded
+    instrumentation - receives the timings of the phases of every heatmap
+    max_seconds - predicted time over which grids are refused, no limit if None
+    max_bytes - predicted memory over which grids are refused, no limit if None
+    _verboseprint - function for debugging purposes
+    _heatmaps - recently used heatmaps, by their parameters, along with the
+                version of their dataset file and a lock guarding their computation
+    _lock - lock guarding _heatmaps
+    _pending - responses being computed, by request
+    _pool - threads computing and rendering responses
+    """
+    port: int
+    workers: int
+    cache_dir: Union[str, None]
+    max_heatmaps: int
+    instrumentation: Instrumentation
+    max_seconds: Union[float, None]
+    max_bytes: Union[int, None]
+    _verboseprint: Callable[..., Union[str, None]]
+    _heatmaps: Dict[tuple, tuple]
+    _lock: threading.Lock
+    _pending: Dict[tuple, asyncio.Future]
+    _pool: ThreadPoolExecutor
+
+    def __init__(self, port: int = DEFAULT_PORT, workers: int = 4,
+                 cache_dir: Union[str, None] = None,
+                 max_heatmaps: int = MAX_HEATMAPS, verbose: bool = False,
+                 instrumentation: Instrumentation = NO_INSTRUMENTATION,
+                 max_seconds: Union[float, None] = DEFAULT_MAX_SECONDS,
+                 max_bytes: Union[int, None] = default_max_bytes()) -> None:
+        """
+        Initializes a new server, which starts listening with serve()
+        Requests for grids over the budget are refused as bad requests
+        """
+        assert workers >= 1, "invalid amount of workers"
+        self.port, self.workers, self.cache_dir = port, workers, cache_dir
+        self.max_heatmaps, self.instrumentation = max_heatmaps, instrumentation
+        self.max_seconds, self.max_bytes = max_seconds, max_bytes
+        self._verboseprint = print if verbose else lambda *a, **k: None
+        self._heatmaps, self._lock, self._pending = OrderedDict(), threading.Lock(), {}
+        self._pool = ThreadPoolExecutor(workers)
+
+    def heatmap(self, query: Dict[str, str]) -> Heatmap:
+        """
+        Returns the heatmap set up by the query arguments with its grid
+        calculated, reusing the loaded one unless its dataset file changed
+        Heatmaps are never changed once calculated, so that they can be
+        read from several threads at once
+        """
+        assert "dataset" in query, "no dataset given"
+        params = {name: parse(query[name]) for name, parse in HEATMAP_ARGS.items()
+                  if name in query}
+        assert params.get("mode", MODES[0]) in MODES, "invalid mode"
+        key = tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                           for name, value in params.items()))
+        stat = os.stat(params["dataset"])
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._heatmaps.pop(key, None)
+            if entry == None or entry[0] != version:
+                entry = (version, Heatmap(filepath=params.pop("dataset"),
+                                          cache_dir=self.cache_dir,
+                                          instrumentation=self.instrumentation,
+                                          max_seconds=self.max_seconds,
+                                          max_bytes=self.max_bytes, **params),
+                         threading.Lock())
+            self._heatmaps[key] = entry
+            while len(self._heatmaps) > self.max_heatmaps:
+                self._heatmaps.popitem(last=False)
+
+        _, heatmap, lock = entry
+        with lock:
+            if not hasattr(heatmap, "grid"):
+                self._verboseprint("Calculating {}...".format(dict(key)))
+                heatmap.calculate_grid()
+        return heatmap
+
+    def respond(self, path: str, query: Dict[str, str]) -> Tuple[int, str, bytes]:
+        """
+        Returns the status, content type and body of the response to a
+        request for path with the query arguments
+        """
+        from matplotlib.image import imsave
+
+        try:
+            display = {name: parse(query[name]) for name, parse in DISPLAY_ARGS.items()
+                       if name in query}
+            parts = path.strip("/").split("/")
+            if parts[0] not in ("grid", "image.png", "map.png", "tiles"):
+                return 404, "text/plain", b"unknown path"
+            heatmap = self.heatmap(query)
+            column, colourmap = display.get("column"), display.get("colourmap")
+            body = io.BytesIO()
+
+            if parts[0] == "grid":
+                np.save(body, heatmap.grid if isinstance(heatmap.value_col, int)
+                        else heatmap.grid[0 if column == None else column])
+                return 200, "application/octet-stream", body.getvalue()
+
+            elif parts[0] == "image.png":
+                imsave(body, heatmap.rgba_image(column, colourmap), format="png")
+
+            elif parts[0] == "map.png":
+                heatmap.save_map(body, colourmap, display.get("legend_loc"),
+                                 display.get("legend_fontsize", 14), column,
+                                 display.get("dpi", DEFAULT_DPI))
+
+            elif parts[0] == "tiles":
+                assert len(parts) == 4 and parts[3].endswith(".png"), "invalid tile"
+                zoom, x, y = int(parts[1]), int(parts[2]), int(parts[3][:-4])
+                rgba = heatmap.tile_exporter(None, column, colourmap).render_tile(zoom, x, y)
+                if rgba is None:
+                    return 204, "image/png", b""
+                imsave(body, rgba, format="png")
+            return 200, "image/png", body.getvalue()
+
+        except (AssertionError, ValueError, KeyError, IndexError, OSError) as err:
+            return 400, "text/plain", "Error: {}".format(err).encode()
+        except Exception as err:
+            return 500, "text/plain", "Error: {}".format(err).encode()
+
+    async def _respond(self, path: str, query: Dict[str, str]) -> Tuple[int, str, bytes]:
+        """
+        Computes the response to a request in the thread pool, sharing
+        it with the identical requests made while it is computed
+        """
+        request = (path, tuple(sorted(query.items())))
+        future = self._pending.get(request)
+        if future == None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._pool, self.respond, path, query)
+            self._pending[request] = future
+            future.add_done_callback(lambda _: self._pending.pop(request, None))
+        else:
+            self._verboseprint("Waiting on the same request: {}".format(path))
+        # a client hanging up must not cancel the response of the others
+        return await asyncio.shield(future)
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        """
+        Answers the http request of a connection
+        """
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            # the headers are not needed
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if len(request) < 2:
+                status, content_type, body = 400, "text/plain", b"invalid request"
+            elif request[0] != "GET":
+                status, content_type, body = 405, "text/plain", b"only GET is supported"
+            else:
+                target = urlsplit(request[1])
+                status, content_type, body = await self._respond(
+                    target.path, dict(parse_qsl(target.query)))
+            self._verboseprint("{} {}".format(status, " ".join(request[:2])))
+            writer.write(("HTTP/1.1 {} {}\r\n"
+                          "Content-Type: {}\r\n"
+                          "Content-Length: {}\r\n"
+                          "Connection: close\r\n\r\n").format(
+                          status, REASONS[status], content_type, len(body)).encode())
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self) -> None:
+        server = await asyncio.start_server(self._handle, HOST, self.port)
+        async with server:
+            await server.serve_forever()
+
+    def serve(self) -> None:
+        """
+        Serves requests until interrupted
+        """
+        print("Serving heatmaps on http://{}:{}/".format(HOST, self.port))
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Serves heatmaps, keeping them "
+                                                  "loaded between requests"))
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="threads computing and rendering responses")
+    parser.add_argument("-cd", "--cache_dir")
+    parser.add_argument("-mh", "--max_heatmaps", type=int, default=MAX_HEATMAPS,
+                        help="amount of heatmaps kept loaded")
+    parser.add_argument("-ev", "--events",
+                        help="json lines file to append the timings of each phase to")
+    args = parser.parse_args()
+
+    HeatmapServer(args.port, args.workers, args.cache_dir, args.max_heatmaps,
+                  args.verbose,
+                  JsonLinesSink(args.events) if args.events else NO_INSTRUMENTATION).serve()
+
+if __name__ == "__main__":
+    main()
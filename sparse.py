@@ -0,0 +1,266 @@
+"""
+sparse grids module for heatmap
+
+With a small radius over a big extent most cells of a grid are 0, only
+the cells around the points having a value. A SparseGrid splits its grids
+into square tiles and only stores the tiles some point reaches, so that
+memory and disk use grow with the area the points cover rather than with
+the area of the map. The dense grids are only built when asked for.
+"""
+from typing import Dict, List, Tuple, Union
+from math import ceil, floor
+import numpy as np
+
+# side of the tiles of sparse grids, in cells
+TILE_CELLS = 64
+
+
+class SparseGrid:
+    """
+    Grid, or stack of grids, of which only the tiles some point reaches
+    are stored, every cell of the other tiles being 0
+
+    shape - shape of the grids, the last two dimensions being their rows and columns
+    tile - side of the tiles, in cells
+    tiles - cells of every grid in each stored tile, by tile row and column,
+            the tiles along the last row and column being cut to the grid
+    _dense - dense copy of the grids, built the first time it is needed
+    """
+    shape: Tuple[int, ...]
+    tile: int
+    tiles: Dict[Tuple[int, int], np.ndarray]
+    _dense: Union[np.ndarray, None]
+
+    dtype = np.dtype(float)
+
+    def __init__(self, shape: Tuple[int, ...], tile: int = TILE_CELLS,
+                 tiles: Union[Dict[Tuple[int, int], np.ndarray], None] = None) -> None:
+        """
+        Initializes sparse grids of the given shape, every cell being 0
+        unless tiles are given
+        """
+        assert len(shape) >= 2 and tile >= 1, "invalid sparse grid"
+        self.shape, self.tile = tuple(int(size) for size in shape), tile
+        self.tiles = {} if tiles == None else tiles
+        self._dense = None
+
+    @property
+    def ndim(self) -> int:
+        """
+        Get the amount of dimensions of the grids
+        """
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        """
+        Get the amount of cells of the grids
+        """
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Get the amount of bytes the stored tiles take up
+        """
+        return sum(cells.nbytes for cells in self.tiles.values())
+
+    @property
+    def tile_rows(self) -> int:
+        """
+        Get the amount of rows of tiles
+        """
+        return ceil(self.shape[-2] / self.tile)
+
+    @property
+    def tile_cols(self) -> int:
+        """
+        Get the amount of columns of tiles
+        """
+        return ceil(self.shape[-1] / self.tile)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, grid: int) -> "SparseGrid":
+        """
+        Returns one grid of the stack, sharing its tiles
+        """
+        assert self.ndim > 2, "can only pick a grid out of a stack of grids"
+        if not -len(self) <= grid < len(self):
+            raise IndexError("grid {} out of range".format(grid))
+        return SparseGrid(self.shape[1:], self.tile,
+                          {key: cells[grid] for key, cells in self.tiles.items()})
+
+    def __iter__(self):
+        return (self[grid] for grid in range(len(self)))
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        dense = self.dense()
+        return dense if dtype == None else dense.astype(dtype)
+
+    def tile_bounds(self, key: Tuple[int, int]) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        Returns the rows and columns of the grids a tile covers
+        """
+        row, col = key
+        return ((row * self.tile, min((row + 1) * self.tile, self.shape[-2])),
+                (col * self.tile, min((col + 1) * self.tile, self.shape[-1])))
+
+    def reach_tiles(self, xs: np.ndarray, ys: np.ndarray,
+                    radius: float) -> List[Tuple[int, int]]:
+        """
+        Returns the tiles with a cell within radius (in grid cells) of
+        one of the points at grid coordinates xs and ys, in row order
+        """
+        reach = floor(radius)
+        covered = np.zeros((self.tile_rows, self.tile_cols), dtype=bool)
+        first_rows = np.maximum((ys - reach) // self.tile, 0)
+        last_rows = np.minimum((ys + reach) // self.tile, self.tile_rows - 1)
+        first_cols = np.maximum((xs - reach) // self.tile, 0)
+        last_cols = np.minimum((xs + reach) // self.tile, self.tile_cols - 1)
+        # each point reaches the same small amount of tiles at most,
+        # which are marked one offset at a time for every point at once
+        span = 2 * reach // self.tile + 2
+        for row_offset in range(span):
+            rows = first_rows + row_offset
+            for col_offset in range(span):
+                cols = first_cols + col_offset
+                inside = (rows <= last_rows) & (cols <= last_cols)
+                covered[rows[inside], cols[inside]] = True
+        return [tuple(key) for key in np.argwhere(covered).tolist()]
+
+    def window(self, rows: Tuple[int, int], cols: Tuple[int, int]) -> np.ndarray:
+        """
+        Returns the cells in rows[0]:rows[1], cols[0]:cols[1] of every grid
+        """
+        if self._dense is not None:
+            return self._dense[..., rows[0]:rows[1], cols[0]:cols[1]].copy()
+        window = np.zeros(self.shape[:-2] + (rows[1] - rows[0], cols[1] - cols[0]))
+        for key, (tile_rows, tile_cols), (cut_rows, cut_cols) in self._overlaps(rows, cols):
+            cells = self.tiles.get(key)
+            if cells is not None:
+                window[..., cut_rows[0]:cut_rows[1], cut_cols[0]:cut_cols[1]] = \
+                    cells[..., tile_rows[0]:tile_rows[1], tile_cols[0]:tile_cols[1]]
+        return window
+
+    def set_window(self, rows: Tuple[int, int], cols: Tuple[int, int],
+                   values: np.ndarray) -> None:
+        """
+        Sets the cells in rows[0]:rows[1], cols[0]:cols[1] of every grid,
+        only storing the tiles left with a value other than 0
+        """
+        for key, (tile_rows, tile_cols), (cut_rows, cut_cols) in self._overlaps(rows, cols):
+            part = values[..., cut_rows[0]:cut_rows[1], cut_cols[0]:cut_cols[1]]
+            cells = self.tiles.get(key)
+            if cells is None:
+                if not part.any():
+                    continue
+                (first_row, last_row), (first_col, last_col) = self.tile_bounds(key)
+                cells = np.zeros(self.shape[:-2] + (last_row - first_row,
+                                                    last_col - first_col))
+            elif not cells.flags.writeable:
+                # tiles mapped from the grid cache are left alone
+                cells = np.array(cells)
+            cells[..., tile_rows[0]:tile_rows[1], tile_cols[0]:tile_cols[1]] = part
+            if cells.any():
+                self.tiles[key] = cells
+            else:
+                self.tiles.pop(key, None)
+        if self._dense is not None:
+            self._dense[..., rows[0]:rows[1], cols[0]:cols[1]] = values
+
+    def _overlaps(self, rows: Tuple[int, int], cols: Tuple[int, int]):
+        """
+        Yields each tile overlapping the window, along with the overlapping
+        rows and columns within the tile and within the window
+        """
+        for row in range(rows[0] // self.tile, ceil(rows[1] / self.tile)):
+            for col in range(cols[0] // self.tile, ceil(cols[1] / self.tile)):
+                (first_row, last_row), (first_col, last_col) = self.tile_bounds((row, col))
+                top, bottom = max(first_row, rows[0]), min(last_row, rows[1])
+                left, right = max(first_col, cols[0]), min(last_col, cols[1])
+                if top < bottom and left < right:
+                    yield ((row, col),
+                           ((top - first_row, bottom - first_row),
+                            (left - first_col, right - first_col)),
+                           ((top - rows[0], bottom - rows[0]),
+                            (left - cols[0], right - cols[0])))
+
+    def take(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Returns the cells at every combination of the given rows and columns
+        of every grid, like grid[np.ix_(rows, cols)], only reading the tiles
+        they fall in
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        if self._dense is not None:
+            return self._dense[..., rows[:, np.newaxis], cols]
+        taken = np.zeros(self.shape[:-2] + (len(rows), len(cols)))
+        row_tiles, col_tiles = rows // self.tile, cols // self.tile
+        for row in np.unique(row_tiles):
+            in_rows = np.flatnonzero(row_tiles == row)
+            for col in np.unique(col_tiles):
+                cells = self.tiles.get((int(row), int(col)))
+                if cells is None:
+                    continue
+                in_cols = np.flatnonzero(col_tiles == col)
+                taken[..., in_rows[:, np.newaxis], in_cols] = cells[
+                    ..., (rows[in_rows] - row * self.tile)[:, np.newaxis],
+                    cols[in_cols] - col * self.tile]
+        return taken
+
+    def dense(self) -> np.ndarray:
+        """
+        Returns the grids as a dense array, built the first time and
+        kept for later calls
+        """
+        if self._dense is None:
+            dense = np.zeros(self.shape)
+            for key, cells in self.tiles.items():
+                rows, cols = self.tile_bounds(key)
+                dense[..., rows[0]:rows[1], cols[0]:cols[1]] = cells
+            self._dense = dense
+        return self._dense
+
+    def min(self) -> float:
+        """
+        Returns the smallest value of the grids
+        """
+        values = [float(cells.min()) for cells in self.tiles.values()]
+        return min(values + [0.0] if self._covered() < self.size else values)
+
+    def max(self) -> float:
+        """
+        Returns the biggest value of the grids
+        """
+        values = [float(cells.max()) for cells in self.tiles.values()]
+        return max(values + [0.0] if self._covered() < self.size else values)
+
+    def _covered(self) -> int:
+        return sum(cells.size for cells in self.tiles.values())
+
+    def to_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the position of each stored tile and their cells stacked,
+        the tiles cut to the grid being padded to the full tile size
+        """
+        keys = sorted(self.tiles)
+        stacked = np.zeros((len(keys),) + self.shape[:-2] + (self.tile, self.tile))
+        for i, key in enumerate(keys):
+            cells = self.tiles[key]
+            stacked[i, ..., :cells.shape[-2], :cells.shape[-1]] = cells
+        return np.array(keys, dtype=np.int64).reshape(-1, 2), stacked
+
+    @classmethod
+    def from_arrays(cls, shape: Tuple[int, ...], tile: int, keys: np.ndarray,
+                    stacked: np.ndarray) -> "SparseGrid":
+        """
+        Returns the sparse grids stored with to_arrays, the tiles being
+        views of stacked so that memory mapped tiles are only read when used
+        """
+        grid = cls(shape, tile)
+        for (row, col), cells in zip(keys.tolist(), stacked):
+            rows, cols = grid.tile_bounds((row, col))
+            grid.tiles[(row, col)] = cells[..., :rows[1] - rows[0], :cols[1] - cols[0]]
+        return grid
@@ -0,0 +1,83 @@
+"""
+spatial index module for heatmap
+"""
+from math import floor
+import numpy as np
+
+
+class SpatialIndex:
+    """
+    Uniform bucket grid over a set of points, used to find the points
+    near a location without comparing against every point
+
+    cell_size - width and height of each bucket
+    _order - point indices sorted by bucket
+    _keys - bucket key of each point in _order
+    _x_min - smallest bucket column of the points
+    _y_min - smallest bucket row of the points
+    _columns - amount of bucket columns spanned by the points
+    _xs - x coordinates of the points
+    _ys - y coordinates of the points
+    """
+    cell_size: float
+    _order: np.ndarray
+    _keys: np.ndarray
+    _x_min: int
+    _y_min: int
+    _columns: int
+    _xs: np.ndarray
+    _ys: np.ndarray
+
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, cell_size: float) -> None:
+        """
+        Buckets the points given by their x and y coordinates
+        """
+        assert cell_size > 0, "cell size must be positive"
+        self.cell_size = cell_size
+        bucket_xs = np.floor(np.asarray(xs, dtype=float) / cell_size).astype(np.int64)
+        bucket_ys = np.floor(np.asarray(ys, dtype=float) / cell_size).astype(np.int64)
+        self._x_min = int(bucket_xs.min()) if len(bucket_xs) else 0
+        self._y_min = int(bucket_ys.min()) if len(bucket_ys) else 0
+        self._columns = int(bucket_xs.max()) - self._x_min + 1 if len(bucket_xs) else 1
+        keys = (bucket_ys - self._y_min) * self._columns + (bucket_xs - self._x_min)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+        self._xs = np.asarray(xs)
+        self._ys = np.asarray(ys)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def query_box(self, x_min: float, x_max: float,
+                  y_min: float, y_max: float) -> np.ndarray:
+        """
+        Returns the sorted indices of the points inside the box, edges included
+        """
+        first_column = max(floor(x_min / self.cell_size) - self._x_min, 0)
+        last_column = min(floor(x_max / self.cell_size) - self._x_min,
+                          self._columns - 1)
+        first_row = max(floor(y_min / self.cell_size) - self._y_min, 0)
+        last_row = floor(y_max / self.cell_size) - self._y_min
+        if first_column > last_column or first_row > last_row or not len(self):
+            return np.empty(0, dtype=np.int64)
+        last_row = min(last_row, int(self._keys[-1]) // self._columns)
+
+        # each row of buckets is a contiguous run of the sorted keys
+        row_keys = np.arange(first_row, last_row + 1) * self._columns
+        starts = np.searchsorted(self._keys, row_keys + first_column, side="left")
+        ends = np.searchsorted(self._keys, row_keys + last_column, side="right")
+        found = np.concatenate([self._order[start:end]
+                                for start, end in zip(starts, ends)] or
+                               [np.empty(0, dtype=np.int64)])
+        xs, ys = self._xs[found], self._ys[found]
+        found = found[(xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max)]
+        found.sort()
+        return found
+
+    def query_radius(self, x: float, y: float, radius: float) -> np.ndarray:
+        """
+        Returns the sorted indices of the points within radius of (x, y)
+        """
+        found = self.query_box(x - radius, x + radius, y - radius, y + radius)
+        dist_sq = (self._xs[found] - x) ** 2 + (self._ys[found] - y) ** 2
+        return found[dist_sq <= radius ** 2]
@@ -0,0 +1,195 @@
+"""
+tiles module for heatmap
+
+Exports a computed grid as a pyramid of web mercator tiles, written as
+{z}/{x}/{y}.png the way web maps load them. Tiles sample the grid cells
+under their pixels, so only the cells a tile shows are read from a
+memory mapped or sparse grid, and they are coloured like the maps are.
+"""
+from typing import TYPE_CHECKING, Callable, Iterable, List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+import os
+from math import asinh, ceil, floor, log2, pi, radians, tan
+import numpy as np
+from colourmaps import influence_rgba, weighted_rgba
+from sparse import SparseGrid
+if TYPE_CHECKING:
+    from matplotlib.colors import Colormap
+
+TILE_SIZE = 256
+MAX_ZOOM = 22
+# web mercator can't show the poles
+MAX_LAT = 85.0511287798
+
+
+def tile_x(lon: float, zoom: int) -> float:
+    """
+    Returns the tile column of a longitude at a zoom level, with fractions
+    """
+    return (lon + 180) / 360 * 2 ** zoom
+
+
+def tile_y(lat: float, zoom: int) -> float:
+    """
+    Returns the tile row of a latitude at a zoom level, with fractions
+    """
+    lat = radians(min(max(lat, -MAX_LAT), MAX_LAT))
+    return (1 - asinh(tan(lat)) / pi) / 2 * 2 ** zoom
+
+
+def native_zoom(scale: float) -> int:
+    """
+    Returns the first zoom level at which a tile pixel is no bigger than
+    a grid cell of the given scale, beyond which tiles show no more detail
+    """
+    return min(max(ceil(log2(360 / (TILE_SIZE * scale))), 0), MAX_ZOOM)
+
+
+class TileExporter:
+    """
+    Writes the tiles of a grid
+
+    directory - directory the tiles are written to
+    grid - grid the tiles show
+    mode - data parsing mode of the grid
+    extent - lat_min, lon_min, lat_max and lon_max of the grid
+    scale - size of a grid cell (in degrees)
+    colourmap - colourmap of weighted grids
+    _vmin - smallest value of a weighted grid, so every tile is coloured alike
+    _vmax - biggest value of a weighted grid
+    """
+    directory: str
+    grid: Union[np.ndarray, SparseGrid]
+    mode: str
+    extent: Tuple[float, float, float, float]
+    scale: float
+    colourmap: Union[str, "Colormap"]
+    _vmin: float
+    _vmax: float
+
+    def __init__(self, directory: str, grid: Union[np.ndarray, SparseGrid], mode: str,
+                 extent: Tuple[float, float, float, float], scale: float,
+                 colourmap: Union[str, "Colormap"] = "viridis_r") -> None:
+        """
+        Initializes an exporter of the tiles of grid into directory
+        """
+        self.directory, self.grid, self.mode = directory, grid, mode
+        self.extent, self.scale, self.colourmap = extent, scale, colourmap
+        self._vmin = self._vmax = 0.0
+        if mode == "weighted" and isinstance(grid, SparseGrid):
+            self._vmin, self._vmax = grid.min(), grid.max()
+        elif mode == "weighted":
+            self._vmin, self._vmax = float(np.nanmin(grid)), float(np.nanmax(grid))
+
+    def tile_path(self, zoom: int, x: int, y: int) -> str:
+        """
+        Returns where a tile is written
+        """
+        return os.path.join(self.directory, str(zoom), str(x), "{}.png".format(y))
+
+    def tile_range(self, zoom: int) -> Tuple[int, int, int, int]:
+        """
+        Returns the first and last tile column and row covering the grid
+        at a zoom level
+        """
+        lat_min, lon_min, lat_max, lon_max = self.extent
+        last = 2 ** zoom - 1
+        return (max(floor(tile_x(lon_min, zoom)), 0), min(floor(tile_x(lon_max, zoom)), last),
+                max(floor(tile_y(lat_max, zoom)), 0), min(floor(tile_y(lat_min, zoom)), last))
+
+    def tiles(self, zooms: Iterable[int]) -> List[Tuple[int, int, int]]:
+        """
+        Returns the zoom, column and row of every tile covering the grid
+        at the given zoom levels
+        """
+        tiles = []
+        for zoom in zooms:
+            first_x, last_x, first_y, last_y = self.tile_range(zoom)
+            tiles.extend((zoom, x, y) for x in range(first_x, last_x + 1)
+                         for y in range(first_y, last_y + 1))
+        return tiles
+
+    def render_tile(self, zoom: int, x: int, y: int) -> Union[np.ndarray, None]:
+        """
+        Returns the rgba bytes of a tile, None if it shows no part of the grid
+        """
+        assert 0 <= zoom <= MAX_ZOOM, "invalid zoom level"
+        lat_min, lon_min = self.extent[:2]
+        grid_height, grid_width = self.grid.shape
+        # lon and lat of the middle of each pixel column and row,
+        # which pick the grid cells the tile shows
+        pixels = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        lons = (x + pixels) / 2 ** zoom * 360 - 180
+        lats = np.degrees(np.arctan(np.sinh(pi * (1 - 2 * (y + pixels) / 2 ** zoom))))
+        cols = np.round((lons - lon_min) / self.scale).astype(np.int64)
+        rows = np.round((lats - lat_min) / self.scale).astype(np.int64)
+        col_inside = (cols >= 0) & (cols < grid_width)
+        row_inside = (rows >= 0) & (rows < grid_height)
+        if not col_inside.any() or not row_inside.any():
+            return None
+
+        values = np.full((TILE_SIZE, TILE_SIZE), np.nan)
+        if isinstance(self.grid, SparseGrid):
+            values[np.ix_(row_inside, col_inside)] = self.grid.take(rows[row_inside],
+                                                                    cols[col_inside])
+        else:
+            values[np.ix_(row_inside, col_inside)] = self.grid[np.ix_(rows[row_inside],
+                                                                      cols[col_inside])]
+        if self.mode == "influence":
+            rgba = influence_rgba(values)
+        else:
+            rgba = weighted_rgba(values, self.colourmap, self._vmin, self._vmax)
+        return rgba if rgba[..., 3].any() else None
+
+    def write_tile(self, zoom: int, x: int, y: int,
+                   overwrite: bool = False) -> Union[str, None]:
+        """
+        Writes a tile unless it was written already, and returns its path
+        Tiles showing no part of the grid are not written, None is
+        returned for them
+        """
+        from matplotlib.image import imsave
+
+        path = self.tile_path(zoom, x, y)
+        if not overwrite and os.path.exists(path):
+            return path
+        rgba = self.render_tile(zoom, x, y)
+        if rgba is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written next to the tile and moved over it, so that a tile
+        # being served is never half written
+        partial = "{}.{}.part".format(path, os.getpid())
+        imsave(partial, rgba, format="png")
+        os.replace(partial, path)
+        return path
+
+    def export(self, zooms: Iterable[int], workers: int = 1,
+               progress: Callable[[Iterable], Iterable] = lambda l: l,
+               overwrite: bool = True) -> List[str]:
+        """
+        Writes every tile covering the grid at the given zoom levels,
+        spread over a pool of workers processes, returns the paths written
+        """
+        tiles = [tile + (overwrite,) for tile in self.tiles(zooms)]
+        if workers <= 1:
+            paths = [self.write_tile(*tile) for tile in progress(tiles)]
+        else:
+            with ProcessPoolExecutor(workers, initializer=_start_worker,
+                                     initargs=(self,)) as pool:
+                paths = list(progress(pool.map(_write_tile, tiles,
+                                               chunksize=max(1, len(tiles) // (workers * 8)))))
+        return [path for path in paths if path != None]
+
+
+# exporter of the tiles written by a worker process
+_worker_exporter: Union[TileExporter, None] = None
+
+
+def _start_worker(exporter: TileExporter) -> None:
+    global _worker_exporter
+    _worker_exporter = exporter
+
+
+def _write_tile(tile: tuple) -> Union[str, None]:
+    return _worker_exporter.write_tile(*tile)
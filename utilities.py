@@ -1,7 +1,14 @@
 """
 utilities module for map
 """
+from typing import Dict, Iterable, List, Sequence, Union
 import csv
+import numpy as np
+
+# amount of rows load_columns collects before packing them into arrays
+CHUNK_ROWS = 65536
+# header of the value column of points not read from a csv file
+DEFAULT_VALUE_LABEL = "Value"
 
 class Counter(dict):
     """ A dictionary with support for
@@ -22,33 +29,154 @@ def load_from_csv(filepath: str, name_col: int = 0,
                   lat_col: int = 1, lon_col: int = 2, 
                   value_col: int = 3) -> tuple:
     """
-    Loads the csv file and processes the data
+    Loads the csv file into lists of names, lats, lons and text values,
+    followed by the header of the value column
     """
-    names, lats, lons, values = [], [], [], []
+    dataset = load_columns(filepath, name_col, lat_col, lon_col, value_col)
+    return [dataset.names.tolist(), dataset.lats.tolist(), dataset.lons.tolist(),
+            [dataset.categories[code] for code in dataset.values],
+            dataset.value_label]
 
-    verify_dataset(filepath)
+class Dataset:
+    """
+    Columns of a dataset loaded into typed arrays
+
+    names - names of the points
+    lats - latitudes of the points
+    lons - longitudes of the points
+    values - codes into categories in influence mode, numbers in weighted mode
+    rows - csv row each entry was read from, values split on "/" share a row
+    categories - distinct values in order of first appearance (influence mode)
+    value_label - header of the value column
+    """
+    names: np.ndarray
+    lats: np.ndarray
+    lons: np.ndarray
+    values: np.ndarray
+    rows: np.ndarray
+    categories: List[str]
+    value_label: str
+
+    def __init__(self, names: np.ndarray, lats: np.ndarray, lons: np.ndarray,
+                 values: np.ndarray, rows: np.ndarray, categories: List[str],
+                 value_label: str) -> None:
+        """
+        Initializes a dataset from its columns
+        """
+        self.names, self.lats, self.lons = names, lats, lons
+        self.values, self.rows = values, rows
+        self.categories, self.value_label = categories, value_label
 
+    def __len__(self) -> int:
+        return len(self.lats)
+
+def load_columns(filepath: str, name_col: int = 0,
+                 lat_col: int = 1, lon_col: int = 2,
+                 value_col: int = 3, mode: str = "influence",
+                 chunk_rows: int = CHUNK_ROWS) -> Dataset:
+    """
+    Loads the csv file into typed columns, chunk_rows rows at a time
+    Rows missing a field or answer are skipped, and values are split on "/"
+    """
+    verify_dataset(filepath)
     with open(filepath) as file:
         reader = csv.reader(file)
-        value_label = next(reader)[value_col]
-        for row in reader:
-            if (not row[name_col].strip()
-                or not row[lat_col].strip()
-                or not row[lon_col].strip()
-                or not row[value_col].strip()):
-                continue
-            if row[value_col] == "no answer" or row[value_col] == "no data":
-                continue
-            name = row[name_col].strip()
-            lat = float(row[lat_col])
-            lon = float(row[lon_col])
-            value_split = row[value_col].strip().split("/")
-            for value in value_split:
-                names.append(name)
-                lats.append(lat)
-                lons.append(lon)
-                values.append(value)
-
-        assert all([len(x) == len(names) for x in [lats, lons, values]])
-
-        return [names, lats, lons, values, value_label]
+        header = next(reader)
+        assert max(name_col, lat_col, lon_col, value_col) < len(header), \
+            "column out of range, the header only has {} columns".format(len(header))
+        value_label = header[value_col]
+        return read_rows(reader, value_label, name_col, lat_col, lon_col,
+                         value_col, mode, chunk_rows)
+
+def read_rows(reader: Iterable[Sequence[str]], value_label: str, name_col: int = 0,
+              lat_col: int = 1, lon_col: int = 2, value_col: int = 3,
+              mode: str = "influence", chunk_rows: int = CHUNK_ROWS) -> Dataset:
+    """
+    Reads rows of text fields, like those of a csv reader past the
+    header, into typed columns, chunk_rows rows at a time
+    """
+    influence = mode == "influence"
+    codes: Dict[str, int] = {}
+    chunks: List[tuple] = []
+
+    def flush(names, lats, lons, values, rows):
+        chunks.append((np.array(names, dtype=str), np.array(lats, dtype=float),
+                       np.array(lons, dtype=float),
+                       np.array(values, dtype=np.int32 if influence else float),
+                       np.array(rows, dtype=np.int64)))
+        del names[:], lats[:], lons[:], values[:], rows[:]
+
+    names, lats, lons, values, rows = [], [], [], [], []
+    for row_number, row in enumerate(reader):
+        if (not row[name_col].strip()
+            or not row[lat_col].strip()
+            or not row[lon_col].strip()
+            or not row[value_col].strip()):
+            continue
+        if row[value_col] == "no answer" or row[value_col] == "no data":
+            continue
+        name = row[name_col].strip()
+        lat = float(row[lat_col])
+        lon = float(row[lon_col])
+        for value in row[value_col].strip().split("/"):
+            names.append(name)
+            lats.append(lat)
+            lons.append(lon)
+            values.append(codes.setdefault(value, len(codes))
+                          if influence else float(value))
+            rows.append(row_number)
+        if len(names) >= chunk_rows:
+            flush(names, lats, lons, values, rows)
+    flush(names, lats, lons, values, rows)
+
+    columns = [np.concatenate(column) for column in zip(*chunks)]
+    return Dataset(*columns, list(codes), value_label)
+
+def dataset_from_rows(rows: Iterable[Sequence[object]],
+                      value_label: str = DEFAULT_VALUE_LABEL,
+                      mode: str = "influence") -> Dataset:
+    """
+    Reads name, lat, lon, value rows from any iterable, a stream being
+    read as it goes, into a dataset
+    The rows are skipped and the values split on "/" like in a csv file
+    """
+    text = (["" if field is None else str(field) for field in row] for row in rows)
+    return read_rows(text, value_label, mode=mode)
+
+def dataset_from_arrays(lats: object, lons: object, values: object,
+                        names: Union[object, None] = None, mode: str = "influence",
+                        categories: Union[List[str], None] = None,
+                        value_label: str = DEFAULT_VALUE_LABEL) -> Dataset:
+    """
+    Builds a dataset from arrays, or any objects supporting the buffer
+    protocol, of the same length, without copying the ones already
+    holding the type the dataset keeps (floats, integer codes)
+    In influence mode the values are codes into categories if it is
+    given, text values being read like in a csv file otherwise
+    Points with a nan coordinate or weighted value are left out, and
+    points without names are named after their position
+    """
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    values = np.asarray(values)
+    assert lats.ndim == lons.ndim == values.ndim == 1, "need one dimensional arrays"
+    assert len(lats) == len(lons) == len(values), "arrays of different lengths"
+    names = (np.arange(len(lats)).astype(str) if names is None
+             else np.asarray(names, dtype=str))
+    assert len(names) == len(lats), "arrays of different lengths"
+
+    keep = np.isfinite(lats) & np.isfinite(lons)
+    if mode == "influence" and (categories is None or values.dtype.kind not in "iu"):
+        # values are read like the cells of a csv file
+        return dataset_from_rows(zip(names[keep], lats[keep], lons[keep], values[keep]),
+                                 value_label, mode)
+    if mode == "influence":
+        assert ((values >= 0) & (values < len(categories))).all(), "invalid category code"
+    else:
+        values = np.asarray(values, dtype=float)
+        keep &= np.isfinite(values)
+    rows = np.arange(len(lats), dtype=np.int64)
+    if not keep.all():
+        names, lats, lons, values, rows = (names[keep], lats[keep], lons[keep],
+                                           values[keep], rows[keep])
+    return Dataset(names, lats, lons, values, rows,
+                   list(categories) if categories is not None else [], value_label)